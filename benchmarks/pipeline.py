@@ -0,0 +1,322 @@
+"""End-to-end benchmark of the upload pipeline against local stand-ins
+
+Runs UploadHandler.process_queue over a synthetic queue with:
+
+* a local aiohttp server standing in for up.hydrax.net
+* a local HTTP origin serving synthetic files, with or without Range
+  support, optionally throttled and jittery
+* a fake userbot implementing download_media/stream_media
+* a fake bot whose status messages only count edits
+
+and reports throughput, peak RSS, event-loop lag and per-item latency.
+
+Usage:
+    python -m benchmarks.pipeline --source url --size 256M --items 8
+    python -m benchmarks.pipeline --source telegram --size 1G --items 2 --throttle 20M
+    python -m benchmarks.pipeline --source url --no-ranges --jitter 0.02 --relay
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BLOCK = random.Random(0).randbytes(1024 * 1024)
+
+def parse_size(value: str) -> int:
+    """Parse sizes like 512K, 64M or 2G"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def synthetic_bytes(seed: int, start: int, length: int) -> bytes:
+    """Deterministic file content, distinct per seed so dedup never kicks in"""
+    out = bytearray()
+    pos = start
+    end = start + length
+    while pos < end:
+        offset = pos % len(BLOCK)
+        take = min(len(BLOCK) - offset, end - pos)
+        out += BLOCK[offset:offset + take]
+        pos += take
+
+    # Stamp a minimal MP4 header carrying the seed over the first bytes of the file
+    header = mp4_header(seed)
+    for i in range(max(start, 0), min(end, len(header))):
+        out[i - start] = header[i]
+    return bytes(out)
+
+def mp4_header(seed: int) -> bytes:
+    """ftyp, a moov with one H.264 video track, and an mdat running to the end of the file"""
+    def box(box_type: bytes, *children: bytes) -> bytes:
+        body = b''.join(children)
+        return struct.pack('>I4s', 8 + len(body), box_type) + body
+
+    mvhd = box(b'mvhd', bytes(4), struct.pack('>III', 0, 0, 1000), struct.pack('>I', 60000), bytes(80))
+    hdlr = box(b'hdlr', bytes(8), b'vide', bytes(12), b'bench\0')
+    avc1 = box(b'avc1', bytes(24), struct.pack('>HH', 1280, 720), bytes(50))
+    stsd = box(b'stsd', bytes(4), struct.pack('>I', 1), avc1)
+    trak = box(b'trak', box(b'mdia', hdlr, box(b'minf', box(b'stbl', stsd))))
+    return (
+        box(b'ftyp', b'isom', bytes(4), b'isomavc1')
+        + box(b'moov', mvhd, trak)
+        + box(b'free', seed.to_bytes(8, 'big'))
+        + struct.pack('>I4s', 0, b'mdat')
+    )
+
+class Throttle:
+    """Per-stream bandwidth limit with optional random stalls"""
+
+    def __init__(self, rate: int, jitter: float):
+        self.rate = rate
+        self.jitter = jitter
+
+    async def wait(self, nbytes: int):
+        delay = nbytes / self.rate if self.rate else 0
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+class FakeMessage:
+    def __init__(self, text: str):
+        self.text = text
+        self.edits = 0
+
+    async def edit_text(self, text: str, **kwargs):
+        self.text = text
+        self.edits += 1
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        message = FakeMessage(text)
+        self.messages.append(message)
+        return message
+
+class FakeUserbot:
+    """Serves synthetic Telegram media in the same 1 MiB parts as pyrogram
+
+    Like pyrogram's get_file, each stream holds a slot of a semaphore of
+    max_concurrent_transmissions for as long as it runs.
+    """
+
+    def __init__(self, sizes: dict, throttle: Throttle, max_concurrent_transmissions: int):
+        self.sizes = sizes
+        self.throttle = throttle
+        self.max_concurrent_transmissions = max_concurrent_transmissions
+        self.get_file_semaphore = asyncio.Semaphore(max_concurrent_transmissions)
+
+    async def stream_media(self, file_id: str, limit: int = 0, offset: int = 0):
+        seed, size = self.sizes[file_id]
+        part = 1024 * 1024
+        index = offset
+        async with self.get_file_semaphore:
+            while index * part < size and (not limit or index < offset + limit):
+                length = min(part, size - index * part)
+                await self.throttle.wait(length)
+                yield synthetic_bytes(seed, index * part, length)
+                index += 1
+
+    async def download_media(self, file_id: str, file_name: str = None, progress=None, **kwargs):
+        _, size = self.sizes[file_id]
+        path = os.path.join(tempfile.gettempdir(), f"bench_{uuid.uuid4().hex}_{os.path.basename(file_name)}")
+        written = 0
+        with open(path, 'wb') as f:
+            async for chunk in self.stream_media(file_id):
+                f.write(chunk)
+                written += len(chunk)
+                if progress:
+                    await progress(written, size)
+        return path
+
+async def start_servers(args, files: dict):
+    """Start the origin and the Hydrax stand-in, returning their runner and base URL"""
+    from aiohttp import web
+
+    throttle = Throttle(args.throttle, args.jitter)
+    uploads = {'bytes': 0, 'count': 0}
+
+    async def origin(request):
+        seed, size = files[request.match_info['name']]
+        start, end = 0, size - 1
+        status = 200
+        headers = {'ETag': f'"{seed}"', 'Content-Type': 'video/mp4'}
+
+        range_header = request.headers.get('Range')
+        if args.ranges:
+            headers['Accept-Ranges'] = 'bytes'
+            if range_header and range_header.startswith('bytes='):
+                first, _, last = range_header[6:].partition('-')
+                start = int(first)
+                end = int(last) if last else size - 1
+                status = 206
+                headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+
+        headers['Content-Length'] = str(end - start + 1)
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+
+        pos = start
+        while pos <= end:
+            length = min(256 * 1024, end - pos + 1)
+            await throttle.wait(length)
+            await response.write(synthetic_bytes(seed, pos, length))
+            pos += length
+
+        await response.write_eof()
+        return response
+
+    async def hydrax(request):
+        reader = await request.multipart()
+        part = await reader.next()
+        while True:
+            chunk = await part.read_chunk(1024 * 1024)
+            if not chunk:
+                break
+            uploads['bytes'] += len(chunk)
+        uploads['count'] += 1
+        return web.json_response({'slug': uuid.uuid4().hex[:10]})
+
+    app = web.Application(client_max_size=0)
+    app.router.add_get('/files/{name}', origin)
+    app.router.add_post('/{key}', hydrax)
+
+    # The range probe hangs up mid-body, don't let cleanup wait a minute on that handler
+    runner = web.AppRunner(app, access_log=None, shutdown_timeout=1)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    return runner, f"http://127.0.0.1:{args.port}", uploads
+
+async def sample_loop_lag(samples: list, interval: float = 0.05):
+    """Record how late the event loop wakes a sleeping task"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def run(args):
+    from utils.database import db
+    from utils.hydrax_api import hydrax_api
+    from utils.http_client import http_client
+    import handlers.upload as upload
+    from userbot import UserbotPool, max_transmissions
+
+    sizes = [parse_size(size) for size in args.size.split(',')]
+    files = {}
+    for i in range(args.items):
+        files[f"file{i}.mp4"] = (i + 1, sizes[i % len(sizes)])
+
+    runner, base_url, uploads = await start_servers(args, files)
+    await http_client.start()
+    hydrax_api.base_url = base_url
+    hydrax_api.api_key = 'bench'
+
+    fake_userbot = FakeUserbot(
+        {name: spec for name, spec in files.items()},
+        Throttle(args.throttle, args.jitter),
+        args.transmissions or max_transmissions()
+    )
+    upload.userbot_pool = UserbotPool([fake_userbot])
+
+    bot = FakeBot()
+    handler = upload.UploadHandler(bot)
+    handler.relay_mode = args.relay
+
+    enqueued = {}
+    finished = {}
+    complete_item = handler._complete_item
+
+    def record_completion(item):
+        finished[item['id']] = time.perf_counter()
+        complete_item(item)
+
+    handler._complete_item = record_completion
+
+    db.clear_queue()
+    for name, (seed, size) in files.items():
+        item = {'user_id': 1, 'chat_id': 1}
+        if args.source == 'telegram':
+            item.update(type='telegram', file_name=name, file_id=name, file_unique_id=name, file_size=size)
+        else:
+            item.update(type='url', url=f"{base_url}/files/{name}")
+        enqueued[db.add_to_queue(item)] = time.perf_counter()
+
+    lag = []
+    lag_task = asyncio.create_task(sample_loop_lag(lag))
+    started = time.perf_counter()
+
+    await handler.process_queue()
+
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+    await http_client.close()
+    await runner.cleanup()
+
+    latencies = [finished[item_id] - enqueued[item_id] for item_id in finished]
+    total_bytes = sum(size for _, size in files.values())
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"source={args.source} items={args.items} sizes={args.size} ranges={args.ranges} "
+          f"relay={args.relay} workers={handler.worker_count}")
+    print(f"completed       {len(finished)}/{args.items} ({uploads['count']} uploads reached the stand-in)")
+    print(f"wall time       {elapsed:.2f}s")
+    print(f"throughput      {total_bytes / elapsed / 1024 ** 2:.1f} MiB/s")
+    print(f"peak RSS        {peak_rss:.0f} MiB")
+    print(f"loop lag        p50={percentile(lag, 50) * 1000:.1f}ms "
+          f"p99={percentile(lag, 99) * 1000:.1f}ms max={max(lag, default=0) * 1000:.1f}ms")
+    if latencies:
+        print(f"item latency    p50={percentile(latencies, 50):.2f}s "
+              f"p95={percentile(latencies, 95):.2f}s mean={statistics.mean(latencies):.2f}s")
+    print(f"status edits    {sum(message.edits for message in bot.messages)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', choices=['url', 'telegram'], default='url')
+    parser.add_argument('--size', default='64M', help="file size, or a comma separated list cycled over items")
+    parser.add_argument('--items', type=int, default=4, help="queue depth")
+    parser.add_argument('--no-ranges', dest='ranges', action='store_false', help="origin ignores Range requests")
+    parser.add_argument('--throttle', type=parse_size, default=0, help="per-stream bytes/s, e.g. 20M")
+    parser.add_argument('--jitter', type=float, default=0.0, help="max random stall per chunk, in seconds")
+    parser.add_argument('--relay', action='store_true', help="enable zero-disk relay mode")
+    parser.add_argument('--workers', type=int, help="QUEUE_WORKERS override")
+    parser.add_argument('--transmissions', type=int, help="userbot max_concurrent_transmissions, 1 is pyrogram's default")
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+
+    # Keep the database, logs and temp files of the run out of the working tree
+    workdir = tempfile.mkdtemp(prefix='hydrax_bench_')
+    os.chdir(workdir)
+    os.environ['DATABASE_FILE'] = os.path.join(workdir, 'bench.db')
+    os.environ.setdefault('CREATOR_ID', '1')
+    if args.workers:
+        os.environ['QUEUE_WORKERS'] = str(args.workers)
+
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
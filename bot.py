@@ -1,25 +1,37 @@
 import os
 import asyncio
-import json
+import time
 from pyrogram import Client, filters, idle
-from pyrogram.types import Message, CallbackQuery
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from typing import Optional, Tuple
 from dotenv import load_dotenv
+
+# Load environment variables before the modules that read them on import
+load_dotenv()
+
 from utils.logger import logger
 from utils.database import db
+from utils.i18n import catalog
+from utils.metrics import metrics
+from utils.diagnostics import loop_monitor
+from utils.http_client import http_client
+from utils.storage import storage
+from utils.media import media_prober
 from handlers.upload import UploadHandler
 from handlers.admin import AdminHandler
 from handlers.language import LanguageHandler
 from handlers.broadcast import BroadcastHandler
 from userbot import start_userbot, stop_userbot
-from utils.helpers import get_next_queue_item
-
-# Load environment variables
-load_dotenv()
+from utils.helpers import get_next_queue_item, format_bytes, format_duration
 
 # Bot configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 CREATOR_ID = int(os.getenv('CREATOR_ID') or 0)
 
+# Queue items shown per /list page
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE') or 20)
+
 if not BOT_TOKEN or not CREATOR_ID:
     logger.error("BOT_TOKEN and CREATOR_ID must be set in environment variables")
     exit(1)
@@ -32,22 +44,15 @@ bot = Client(
     api_hash="b18441a1ff607e10a989891a5462e627"
 )
 
-# Initialize handlers
-upload_handler = UploadHandler(bot)
+# Initialize handlers, leaving transfers to worker.py processes when WORKER_MODE=external
+upload_handler = UploadHandler(bot, run_workers=os.getenv('WORKER_MODE', 'local').lower() != 'external')
 admin_handler = AdminHandler(bot)
 language_handler = LanguageHandler(bot)
 broadcast_handler = BroadcastHandler(bot)
 
 def get_lang_string(user_id: int, key: str) -> str:
     """Get language string for user"""
-    lang = db.get_user_language(user_id)
-    lang_file = f"lang/{lang}.json"
-    try:
-        with open(lang_file, 'r', encoding='utf-8') as f:
-            lang_strings = json.load(f)
-            return lang_strings.get(key, key)
-    except FileNotFoundError:
-        return key
+    return catalog.get(db.get_user_language(user_id), key)
 
 # Command handlers
 @bot.on_message(filters.command("start"))
@@ -56,10 +61,13 @@ async def start_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
+    # Someone who starts the bot again can receive broadcasts again
+    db.unblock_user(user_id)
+
     lang_str = get_lang_string(user_id, 'start')
     await message.reply_text(lang_str)
 
@@ -69,7 +77,7 @@ async def help_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
@@ -82,25 +90,87 @@ async def list_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
-    queue = db.get_queue()
-    if not queue:
-        lang_str = get_lang_string(user_id, 'empty_queue')
-        await message.reply_text(lang_str)
-    else:
-        queue_text = "\n".join([
-            f"{i+1}. {'📱' if item['type'] == 'telegram' else '🔗'} {item.get('file_name', item.get('url', 'Unknown'))}"
-            for i, item in enumerate(queue)
-        ])
-        next_item = get_next_queue_item(queue)
-        
-        lang_str = get_lang_string(user_id, 'processing_queue')
-        await message.reply_text(
-            lang_str.format(queue=queue_text, next_item=next_item)
-        )
+    # /list mine shows your own items, the creator can pass any user id
+    args = message.text.split()[1:]
+    owner = None
+    if args and args[0] == 'mine':
+        owner = user_id
+    elif args and args[0].isdigit() and user_id == CREATOR_ID:
+        owner = int(args[0])
+    elif args:
+        await message.reply_text("❌ Usage: /list [mine]")
+        return
+
+    text, keyboard = render_queue_page(user_id, 1, owner)
+    await message.reply_text(text, reply_markup=keyboard)
+
+@bot.on_callback_query(filters.regex(r"^list_\d+_(all|\d+)$"))
+async def list_page_callback(client: Client, callback_query: CallbackQuery):
+    """Show another page of /list"""
+    user_id = callback_query.from_user.id
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
+        await callback_query.answer("❌ You are not authorized to use this bot.")
+        return
+
+    _, page, scope = callback_query.data.split('_')
+    owner = None if scope == 'all' else int(scope)
+    if owner is not None and owner != user_id and user_id != CREATOR_ID:
+        await callback_query.answer()
+        return
+
+    text, keyboard = render_queue_page(user_id, int(page), owner)
+    try:
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer()
+
+def render_queue_page(user_id: int, page: int, owner: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Build one /list page with its summary header and navigation buttons"""
+    summary = db.queue_summary(owner)
+    if not summary['items']:
+        return get_lang_string(user_id, 'empty_queue'), None
+
+    pages = (summary['items'] + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page = min(max(page, 1), pages)
+    offset = (page - 1) * LIST_PAGE_SIZE
+    now = time.time()
+
+    lines = []
+    for i, item in enumerate(upload_handler.scheduled_queue(offset, LIST_PAGE_SIZE, owner)):
+        name = item.get('file_name', item.get('url', 'Unknown'))
+        if len(name) > 60:
+            name = name[:57] + "..."
+        state = "▶️ " if item['status'] == 'active' else "⏳ " if item['available_at'] > now else ""
+        lines.append(f"{offset + i + 1}. {state}{'📱' if item['type'] == 'telegram' else '🔗'} {name}")
+
+    size = format_bytes(summary['bytes'])
+    if summary['unknown']:
+        size += f" (+{summary['unknown']} ?)"
+    drain = upload_handler.estimate_drain_time(summary['bytes'])
+    next_item = upload_handler.next_item(owner)
+
+    text = get_lang_string(user_id, 'processing_queue').format(
+        page=page,
+        pages=pages,
+        count=summary['items'],
+        size=size,
+        eta=format_duration(drain) if drain is not None else "?",
+        queue="\n".join(lines),
+        next_item=get_next_queue_item([next_item] if next_item else [], [])
+    )
+
+    scope = 'all' if owner is None else owner
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=f"list_{page - 1}_{scope}"))
+    if page < pages:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=f"list_{page + 1}_{scope}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
 
 @bot.on_message(filters.command("server"))
 async def server_command(client: Client, message: Message):
@@ -108,7 +178,7 @@ async def server_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
@@ -121,7 +191,7 @@ async def ping_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
@@ -137,7 +207,7 @@ async def hapi_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
@@ -153,7 +223,7 @@ async def update_api_key(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
@@ -192,25 +262,35 @@ async def cancel_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Check authorization
-    if user_id != CREATOR_ID and user_id not in db.get_users():
+    if user_id != CREATOR_ID and not db.is_authorized(user_id):
         await message.reply_text("❌ You are not authorized to use this bot.")
         return
     
-    # Clear queue for this user
-    queue = db.get_queue()
-    user_queue = [item for item in queue if item['user_id'] == user_id]
-    
-    # Remove user's items from queue
-    for item in reversed(user_queue):
-        queue = db.get_queue()
-        for i, q in enumerate(queue):
-            if q == item:
-                db.remove_from_queue(i)
-                break
+    # Drop this user's items and stop any that are being transferred
+    upload_handler.cancel_user_items(user_id)
     
     lang_str = get_lang_string(user_id, 'cancelled')
     await message.reply_text(lang_str)
 
+@bot.on_message(filters.command("workers") & filters.user(CREATOR_ID))
+async def workers_command(client: Client, message: Message):
+    """Show which worker holds which queue item"""
+    await message.reply_text(
+        "👷 **Workers**\n\n" + "\n".join(upload_handler.get_worker_status())
+    )
+
+@bot.on_message(filters.command("sessions") & filters.user(CREATOR_ID))
+async def sessions_command(client: Client, message: Message):
+    """Show the load and throughput of each userbot session"""
+    from userbot import userbot_pool
+    if not upload_handler.run_workers:
+        await message.reply_text("🤖 Userbot sessions run in the worker processes (WORKER_MODE=external)")
+        return
+
+    await message.reply_text(
+        "🤖 **Userbot sessions**\n\n" + "\n".join(userbot_pool.status())
+    )
+
 # Video and URL handlers
 @bot.on_message(filters.video)
 async def handle_video(client: Client, message: Message):
@@ -225,21 +305,46 @@ async def handle_url(client: Client, message: Message):
 async def main():
     """Main function"""
     logger.info("Starting Hydrax Uploader Bot...")
+
+    # Watch for blocking calls from the start when DIAGNOSTICS is set
+    loop_monitor.start()
+
+    # One pooled HTTP session for every outbound request
+    await http_client.start()
     
     # Setup handlers
     await admin_handler.setup_handlers()
     await language_handler.setup_handlers()
     await broadcast_handler.setup_handlers()
     
-    # Start userbot
-    await start_userbot()
+    # Start userbot, unless the worker processes do all the downloading
+    if upload_handler.run_workers:
+        await start_userbot()
     
     # Start bot
     logger.info("Bot started successfully!")
     await bot.start()
+
+    # Time every handler and expose the metrics endpoint if configured
+    metrics.instrument_handlers(bot)
+    await metrics.start_server()
+
+    # Resume any items left in the queue, including ones interrupted mid-transfer
+    db.requeue_active_items(upload_handler.worker_name)
+    if not db.active_items():
+        # Partial files are only orphaned while no worker process is mid-transfer
+        storage.sweep(db.transfer_paths())
+    upload_handler.wake_workers()
+    upload_handler.start_supervisor()
+    await broadcast_handler.resume_jobs()
     
     # Keep bot running
     await idle()
 
+    media_prober.close()
+    if upload_handler.run_workers:
+        await stop_userbot()
+    await http_client.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,9 +1,24 @@
+import asyncio
+import io
 import os
 import json
+import re
+import time
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from utils.database import db
-from utils.logger import logger
+from utils.dedup import dedup
+from utils.diagnostics import loop_monitor
+from utils.helpers import format_bytes
+from utils.logger import logger, read_log
+from utils.metrics import metrics
+
+# Sliding windows reported by /stats
+STATS_WINDOWS = (("5m", 300), ("1h", 3600))
+
+# /log windows like 30m, 2h or 1d
+LOG_WINDOW = re.compile(r'^(\d+)([smhd])$')
+LOG_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
 
 class AdminHandler:
     def __init__(self, bot):
@@ -36,15 +51,118 @@ class AdminHandler:
 
         @self.bot.on_message(filters.command("log") & filters.user(int(os.getenv('CREATOR_ID'))))
         async def send_log(client: Client, message: Message):
-            """Send bot log file"""
+            """Send the last lines of the bot log, or the lines of a recent time window"""
+            args = message.text.split()[1:]
+            lines, since = 200, None
+            if args and args[0].isdigit() and int(args[0]) > 0:
+                lines = int(args[0])
+                caption = f"📋 Last {lines} log lines"
+            elif args and LOG_WINDOW.match(args[0]):
+                amount, unit = LOG_WINDOW.match(args[0]).groups()
+                since = time.time() - int(amount) * LOG_UNITS[unit]
+                caption = f"📋 Log of the last {args[0]}"
+            elif args:
+                await message.reply_text("❌ Usage: /log [lines | 30m | 2h | 1d]")
+                return
+            else:
+                caption = f"📋 Last {lines} log lines"
+
             try:
-                if os.path.exists("bot.log"):
-                    await client.send_document(
-                        message.chat.id,
-                        "bot.log",
-                        caption="📋 Bot activity log"
-                    )
-                else:
-                    await message.reply_text("❌ Log file not found")
+                # Rotated segments are gzipped, read them off the event loop
+                text = await asyncio.get_running_loop().run_in_executor(None, read_log, lines, since)
+                if not text:
+                    await message.reply_text("❌ No log lines found")
+                    return
+
+                document = io.BytesIO(text.encode())
+                document.name = "bot.log"
+                await client.send_document(message.chat.id, document, caption=caption)
             except Exception as e:
                 await message.reply_text(f"❌ Error sending log: {str(e)}")
+
+        @self.bot.on_message(filters.command("purgecache") & filters.user(int(os.getenv('CREATOR_ID'))))
+        async def purge_cache(client: Client, message: Message):
+            """Purge the upload dedup cache"""
+            args = message.text.split()[1:]
+            if args and args[0] != 'expired':
+                await message.reply_text("❌ Usage: /purgecache [expired]")
+                return
+
+            removed = dedup.purge(expired_only=bool(args))
+            await message.reply_text(f"🧹 Removed {removed} cached uploads")
+            logger.info(f"Dedup cache purged by creator ({removed} entries)")
+
+        @self.bot.on_message(filters.command("stats") & filters.user(int(os.getenv('CREATOR_ID'))))
+        async def send_stats(client: Client, message: Message):
+            """Report queue, transfer and handler metrics"""
+            await message.reply_text(self.format_stats())
+
+        @self.bot.on_message(filters.command("diag") & filters.user(int(os.getenv('CREATOR_ID'))))
+        async def send_diagnostics(client: Client, message: Message):
+            """Report event loop lag, stalls and busy time per handler"""
+            args = message.text.split()[1:]
+            if args == ['reset']:
+                loop_monitor.reset()
+                await message.reply_text("🩺 Diagnostics reset")
+                return
+
+            report = loop_monitor.report()
+            if len(report) <= 4000:
+                await message.reply_text(f"```\n{report}\n```")
+                return
+
+            # Stack traces quickly outgrow a message, send those as a file
+            document = io.BytesIO(report.encode())
+            document.name = "diagnostics.txt"
+            await client.send_document(message.chat.id, document, caption="🩺 Event loop diagnostics")
+
+    def format_stats(self) -> str:
+        """Summarize the metrics over each sliding window"""
+        lines = [
+            "📊 **Stats**\n",
+            f"**Queue:** {metrics.value('hydrax_queue_items', status='pending'):.0f} pending, "
+            f"{metrics.value('hydrax_queue_items', status='active'):.0f} active, "
+            f"{metrics.value('hydrax_queue_items', status='failed'):.0f} failed",
+            f"**Busy workers:** {metrics.value('hydrax_workers_busy'):.0f}"
+        ]
+
+        for label, seconds in STATS_WINDOWS:
+            lines.append(f"\n**Last {label}**")
+            lines.append(f"⏳ Queue wait: {self._format_percentiles('hydrax_queue_wait_seconds', seconds)}")
+
+            for stage, icon in (('download', '📥'), ('upload', '📤'), ('relay', '🔀')):
+                line = f"{icon} {stage.title()}: {self._format_percentiles('hydrax_transfer_seconds', seconds, stage=stage)}"
+                count, speeds = metrics.percentiles('hydrax_transfer_speed_bytes', seconds, (50,), stage=stage)
+                if count:
+                    line += f" · {format_bytes(speeds[0])}/s median"
+                lines.append(line)
+
+            outcomes = {
+                outcome: metrics.total('hydrax_items_total', seconds, outcome=outcome)
+                for outcome in ('completed', 'deduplicated', 'retried', 'failed')
+            }
+            lines.append("✅ Items: " + ", ".join(f"{count:.0f} {outcome}" for outcome, count in outcomes.items()))
+
+            requests = metrics.total('hydrax_api_requests_total', seconds)
+            errors = requests - metrics.total('hydrax_api_requests_total', seconds, result='ok')
+            rate = f" ({errors / requests * 100:.1f}%)" if requests else ""
+            lines.append(f"☁️ Hydrax: {requests:.0f} requests, {errors:.0f} errors{rate}")
+
+            lines.append(
+                f"🌊 FloodWaits: {metrics.total('hydrax_floodwaits_total', seconds):.0f} "
+                f"({metrics.total('hydrax_floodwait_seconds_total', seconds):.0f}s)"
+            )
+            lines.append(f"⚡ Handlers: {self._format_percentiles('hydrax_handler_seconds', seconds)}")
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_percentiles(name: str, seconds: float, **labels) -> str:
+        """Format p50/p95/p99 of a histogram over a window"""
+        count, values = metrics.percentiles(name, seconds, **labels)
+        if not count:
+            return "no data"
+        p50, p95, p99 = (
+            f"{value * 1000:.0f}ms" if value < 1 else f"{value:.1f}s" for value in values
+        )
+        return f"p50 {p50} · p95 {p95} · p99 {p99} (n={count})"
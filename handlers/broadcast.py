@@ -1,15 +1,29 @@
 import os
 import asyncio
+import time
+import uuid
+from typing import Dict, Optional, Set, Tuple
 from pyrogram import Client, filters
+from pyrogram.errors import (
+    FloodWait, UserIsBlocked, InputUserDeactivated, UserDeactivated, UserDeactivatedBan
+)
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from utils.database import db
 from utils.logger import logger
-import json
+from utils.metrics import metrics
+from utils.ratelimit import TokenBucket
 
 class BroadcastHandler:
     def __init__(self, bot):
         self.bot = bot
         self.broadcast_data = {}
+        self.running: Dict[str, asyncio.Task] = {}
+        self.paused: Set[str] = set()
+        self.concurrency = int(os.getenv('BROADCAST_CONCURRENCY') or 20)
+        self.status_interval = float(os.getenv('BROADCAST_STATUS_INTERVAL') or 3)
+
+        # Shared by every broadcast, Telegram allows about 30 messages per second
+        self.bucket = TokenBucket(float(os.getenv('BROADCAST_RATE') or 25))
 
     async def setup_handlers(self):
         """Setup broadcast command handlers"""
@@ -18,6 +32,7 @@ class BroadcastHandler:
         async def start_broadcast(client: Client, message: Message):
             """Start broadcast setup"""
             self.broadcast_data[message.chat.id] = {
+                'job_id': uuid.uuid4().hex[:12],
                 'messages': [],
                 'stage': 'collecting'
             }
@@ -64,81 +79,217 @@ class BroadcastHandler:
                 await callback_query.message.edit_text("📢 Send me another message:")
 
             elif action == 'send':
-                await self.send_broadcast(client, chat_id, callback_query)
+                await self.preview_broadcast(chat_id, callback_query)
 
-    async def send_broadcast(self, client: Client, chat_id: int, callback_query):
-        """Send broadcast to all users"""
-        if chat_id not in self.broadcast_data:
-            return
+            elif action == 'confirmed':
+                job_id = callback_query.data.split('_', 2)[2]
+                await self.confirm_broadcast(client, chat_id, job_id, callback_query)
+
+            elif action == 'pause':
+                job_id = callback_query.data.split('_', 2)[2]
+                if job_id in self.running and not self.running[job_id].done():
+                    self.paused.add(job_id)
+                    await callback_query.answer("⏸ Pausing after in-flight messages...")
+
+            elif action == 'resume':
+                job_id = callback_query.data.split('_', 2)[2]
+                job = db.get_broadcast(job_id)
+                if job and job['status'] == 'paused':
+                    db.set_broadcast_status(job_id, 'sending')
+                    await callback_query.message.edit_text(f"▶️ Resuming broadcast `{job_id}`...")
+                    self.start_job(client, job_id)
+
+        @self.bot.on_message(filters.command("broadcasts") & filters.user(int(os.getenv('CREATOR_ID'))))
+        async def list_broadcasts(client: Client, message: Message):
+            """Report on recent broadcasts"""
+            jobs = db.list_broadcasts()
+            if not jobs:
+                await message.reply_text("📢 No broadcasts yet")
+                return
+
+            lines = []
+            for job in jobs:
+                stats = db.broadcast_stats(job['id'])
+                lines.append(
+                    f"`{job['id']}` - **{job['status']}**\n"
+                    f"✅ {stats['sent']} ❌ {stats['failed']} 🚫 {stats['blocked']} "
+                    f"👻 {stats['deactivated']} ⏳ {stats['pending']}"
+                )
 
-        # Get all users who have started the bot
-        users = db.get_users()
-        users.append(int(os.getenv('CREATOR_ID')))
+            await message.reply_text("📢 **Broadcasts**\n\n" + "\n\n".join(lines))
 
-        # Combine messages
+    def _combine_messages(self, chat_id: int) -> str:
+        """Combine the collected messages into the announcement text"""
         combined_message = ""
         for msg in self.broadcast_data[chat_id]['messages']:
             if msg.text:
                 combined_message += msg.text + "\n\n"
             elif msg.caption:
                 combined_message += msg.caption + "\n\n"
+        return combined_message.strip()
+
+    async def preview_broadcast(self, chat_id: int, callback_query):
+        """Show the announcement and ask for confirmation"""
+        if chat_id not in self.broadcast_data:
+            return
+
+        data = self.broadcast_data[chat_id]
+        data['stage'] = 'confirming'
 
-        # Preview
         await callback_query.message.edit_text(
-            f"📢 **Preview:**\n\n{combined_message}\n\nSend this announcement?",
+            f"📢 **Preview:**\n\n{self._combine_messages(chat_id)}\n\nSend this announcement?",
             reply_markup=InlineKeyboardMarkup([
                 [
-                    InlineKeyboardButton("✅ Send", callback_data="broadcast_confirmed"),
+                    InlineKeyboardButton("✅ Send", callback_data=f"broadcast_confirmed_{data['job_id']}"),
                     InlineKeyboardButton("❌ Cancel", callback_data="broadcast_cancel")
                 ]
             ])
         )
 
-        @client.on_callback_query(filters.regex("^broadcast_confirmed"))
-        async def confirmed_broadcast(client: Client, callback_query):
-            if callback_query.message.chat.id != chat_id:
-                return
+    async def confirm_broadcast(self, client: Client, chat_id: int, job_id: str, callback_query):
+        """Start the broadcast the preview belongs to"""
+        data = self.broadcast_data.get(chat_id)
+        if data is None or data['job_id'] != job_id or data['stage'] != 'confirming':
+            await callback_query.answer("This broadcast is no longer pending", show_alert=True)
+            return
+
+        users = set(db.get_users())
+        users.add(int(os.getenv('CREATOR_ID')))
+        db.create_broadcast(job_id, chat_id, self._combine_messages(chat_id), list(users))
 
-            await callback_query.message.edit_text("📢 Sending broadcast...")
+        # The job lives in the database from here on
+        del self.broadcast_data[chat_id]
 
-            # Get unique users
-            all_users = set(users)
-            success = 0
-            failed = 0
-            blocked = 0
+        await callback_query.message.edit_text(f"📢 Sending broadcast `{job_id}`...")
+        self.start_job(client, job_id)
 
-            status_msg = await client.send_message(chat_id, "📢 Starting broadcast...")
+    def start_job(self, client: Client, job_id: str):
+        """Run a broadcast job in the background unless it is already running"""
+        task = self.running.get(job_id)
+        if task is None or task.done():
+            # Run in the background so the handler doesn't hold an update worker
+            self.running[job_id] = asyncio.create_task(self._run_broadcast(client, job_id))
 
-            for idx, user_id in enumerate(all_users):
+    async def resume_jobs(self):
+        """Continue broadcasts that were interrupted by a restart"""
+        for job in db.list_broadcasts(status='sending', limit=100):
+            logger.info(f"Resuming broadcast {job['id']}")
+            self.start_job(self.bot, job['id'])
+
+    async def _run_broadcast(self, client: Client, job_id: str):
+        """Send a broadcast job and report on it"""
+        job = db.get_broadcast(job_id)
+        try:
+            await self.send_broadcast(client, job)
+        except Exception as e:
+            logger.error(f"Broadcast {job_id} failed: {e}")
+            await client.send_message(job['chat_id'], f"❌ Broadcast failed: {str(e)}")
+
+    async def send_broadcast(self, client: Client, job: dict):
+        """Send broadcast to every recipient that has not been reached yet"""
+        job_id = job['id']
+        chat_id = job['chat_id']
+        text = job['text']
+
+        pending = asyncio.Queue()
+        for user_id in db.pending_recipients(job_id):
+            pending.put_nowait(user_id)
+        total = sum(db.broadcast_stats(job_id).values())
+
+        pause_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("⏸ Pause", callback_data=f"broadcast_pause_{job_id}")
+        ]])
+        status_msg = await client.send_message(
+            chat_id, f"📢 Starting broadcast `{job_id}`...", reply_markup=pause_markup
+        )
+        started = time.monotonic()
+        flood_waits = 0
+
+        async def sender():
+            nonlocal flood_waits
+            while not pending.empty() and job_id not in self.paused:
+                user_id = pending.get_nowait()
+                outcome, error, waits = await self._deliver(client, user_id, text)
+                flood_waits += waits
+                db.record_delivery(job_id, user_id, outcome, error)
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(self.status_interval)
+                stats = db.broadcast_stats(job_id)
                 try:
-                    await client.send_message(user_id, combined_message.strip())
-                    success += 1
-                except Exception as e:
-                    if "blocked" in str(e).lower():
-                        blocked += 1
-                    else:
-                        failed += 1
-
-                # Update status every 5 users
-                if idx % 5 == 0 or idx == len(all_users) - 1:
                     await status_msg.edit_text(
-                        f"📢 Broadcasting...\n\n"
-                        f"✅ Sent: {success}\n"
-                        f"❌ Failed: {failed}\n"
-                        f"🚫 Blocked: {blocked}\n"
-                        f"⏳ Remaining: {len(all_users) - success - failed - blocked}"
+                        f"📢 Broadcasting `{job_id}`...\n\n"
+                        f"{self._format_stats(stats)}\n"
+                        f"⏳ Remaining: {stats['pending']}/{total}",
+                        reply_markup=pause_markup
                     )
+                except FloodWait as e:
+                    metrics.inc('hydrax_floodwaits_total', source='broadcast_status')
+                    metrics.inc('hydrax_floodwait_seconds_total', e.value, source='broadcast_status')
+                    await asyncio.sleep(e.value)
+                except Exception:
+                    pass
+
+        reporter_task = asyncio.create_task(reporter())
+        try:
+            await asyncio.gather(*(sender() for _ in range(max(1, min(self.concurrency, pending.qsize())))))
+        finally:
+            reporter_task.cancel()
 
-                await asyncio.sleep(0.5)  # Anti-spam delay
+        elapsed = time.monotonic() - started
+        stats = db.broadcast_stats(job_id)
+        logger.info(f"Broadcast {job_id} ran for {elapsed:.1f}s ({flood_waits} FloodWaits): {stats}")
 
+        if job_id in self.paused:
+            self.paused.discard(job_id)
+            db.set_broadcast_status(job_id, 'paused')
             await status_msg.edit_text(
-                f"✅ Broadcast completed!\n\n"
-                f"📊 **Summary:**\n"
-                f"✅ Sent: {success}\n"
-                f"❌ Failed: {failed}\n"
-                f"🚫 Blocked: {blocked}"
+                f"⏸ Broadcast `{job_id}` paused\n\n"
+                f"{self._format_stats(stats)}\n"
+                f"⏳ Remaining: {stats['pending']}/{total}",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("▶️ Resume", callback_data=f"broadcast_resume_{job_id}")
+                ]])
             )
+            return
 
-            # Clean up
-            if chat_id in self.broadcast_data:
-                del self.broadcast_data[chat_id]
+        db.set_broadcast_status(job_id, 'completed')
+        await status_msg.edit_text(
+            f"✅ Broadcast completed!\n\n"
+            f"📊 **Summary:**\n"
+            f"{self._format_stats(stats)}\n"
+            f"⏱ Time: {elapsed:.0f}s"
+        )
+
+    async def _deliver(self, client: Client, user_id: int, text: str) -> Tuple[str, Optional[str], int]:
+        """Send to a single user under the rate limit and classify the outcome"""
+        flood_waits = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await client.send_message(user_id, text)
+                return 'sent', None, flood_waits
+            except FloodWait as e:
+                # Pause every sender only as long as Telegram asks, then retry
+                flood_waits += 1
+                metrics.inc('hydrax_floodwaits_total', source='broadcast')
+                metrics.inc('hydrax_floodwait_seconds_total', e.value, source='broadcast')
+                self.bucket.pause(e.value)
+            except UserIsBlocked:
+                return 'blocked', None, flood_waits
+            except (InputUserDeactivated, UserDeactivated, UserDeactivatedBan):
+                return 'deactivated', None, flood_waits
+            except Exception as e:
+                logger.warning(f"Broadcast to {user_id} failed: {e}")
+                return 'failed', str(e), flood_waits
+
+    @staticmethod
+    def _format_stats(stats: dict) -> str:
+        """Format delivery counters for a status message"""
+        return (
+            f"✅ Sent: {stats['sent']}\n"
+            f"❌ Failed: {stats['failed']}\n"
+            f"🚫 Blocked: {stats['blocked']}\n"
+            f"👻 Deactivated: {stats['deactivated']}"
+        )
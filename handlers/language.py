@@ -3,7 +3,7 @@ from pyrogram.types import Message, CallbackQuery
 from utils.database import db
 from utils.helpers import get_language_keyboard
 from utils.logger import logger
-import json
+from utils.i18n import catalog
 import os
 
 class LanguageHandler:
@@ -19,7 +19,7 @@ class LanguageHandler:
             user_id = message.from_user.id
 
             # Check authorization
-            if user_id != int(os.getenv('CREATOR_ID')) and user_id not in db.get_users():
+            if user_id != int(os.getenv('CREATOR_ID')) and not db.is_authorized(user_id):
                 await message.reply_text("❌ You are not authorized to use this bot.")
                 return
 
@@ -36,12 +36,4 @@ class LanguageHandler:
 
             db.set_user_language(user_id, lang_code)
 
-            # Load language strings
-            lang_file = f"lang/{lang_code}.json"
-            try:
-                with open(lang_file, 'r', encoding='utf-8') as f:
-                    lang = json.load(f)
-            except FileNotFoundError:
-                lang = {"language_changed": "✅ Language changed"}
-
-            await callback_query.message.edit_text(lang['language_changed'])
+            await callback_query.message.edit_text(catalog.get(lang_code, 'language_changed'))
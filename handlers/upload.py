@@ -1,234 +1,677 @@
 import os
 import asyncio
+import mimetypes
 import time
-import tempfile
+from typing import Dict, Any, List, Optional, Set, Tuple
 from pyrogram import Client, filters
+from pyrogram.errors import FloodWait
 from pyrogram.types import Message
 from utils.database import db
+from utils.dedup import dedup, hash_file
 from utils.hydrax_api import hydrax_api
-from utils.helpers import create_progress_bar, format_bytes, get_next_queue_item
-from utils.logger import logger
-from userbot import userbot
+from utils.helpers import get_next_queue_item
+from utils.logger import logger, set_log_context
+from utils.media import media_prober, InvalidMedia, TruncatedMedia
+from utils.metrics import metrics
+from utils.downloader import SegmentedDownloader, TelegramDownloader
+from utils.http_client import http_client
+from utils.progress import ProgressReporter
+from utils.relay import relay
+from utils.scheduler import get_scheduler
+from utils.storage import storage, InsufficientStorage, StorageRejected
+from userbot import userbot_pool
 import aiohttp
 
+MAX_FILE_SIZE = 10 * 1024 * 1024 * 1024  # 10GB
+
 class UploadHandler:
-    def __init__(self, bot):
+    def __init__(self, bot, worker_name: str = 'bot', run_workers: bool = True):
         self.bot = bot
-        self.processing = False
+        self.worker_name = worker_name
+        self.run_workers = run_workers
+        self.worker_count = int(os.getenv('QUEUE_WORKERS') or 2)
+        self.download_slots = asyncio.Semaphore(int(os.getenv('DOWNLOAD_CONCURRENCY') or 1))
+        self.upload_slots = asyncio.Semaphore(int(os.getenv('UPLOAD_CONCURRENCY') or 1))
+        self.worker_tasks: Dict[int, asyncio.Task] = {}
+        self.workers: Dict[int, Dict[str, Any]] = {}
+        self.cancelled: Set[str] = set()
+        self.lost: Set[str] = set()
+        self.finished: Set[str] = set()
+        self.supervisor: Optional[asyncio.Task] = None
+        self.lease = float(os.getenv('QUEUE_LEASE') or 60)
+        self.schedule_window = int(os.getenv('SCHEDULER_WINDOW') or 100)
+        self.poll_interval = min(float(os.getenv('QUEUE_POLL_INTERVAL') or 5), self.lease / 3)
+        self.scheduler = get_scheduler()
+        self.relay_mode = os.getenv('RELAY_MODE', '').lower() in ('1', 'true', 'yes')
+        self.relay_buffer_size = int(os.getenv('RELAY_BUFFER_SIZE') or 16 * 1024 * 1024)
+        self.max_attempts = int(os.getenv('TRANSFER_MAX_ATTEMPTS') or 4)
+        self.retry_backoff = float(os.getenv('TRANSFER_RETRY_BACKOFF') or 30)
+        metrics.add_collector(self._collect_metrics)
 
     async def handle_video(self, client: Client, message: Message):
         """Handle video messages"""
         user_id = message.from_user.id
 
         # Check authorization
-        if user_id != int(os.getenv('CREATOR_ID')) and user_id not in db.get_users():
+        if user_id != int(os.getenv('CREATOR_ID')) and not db.is_authorized(user_id):
             await message.reply_text("❌ You are not authorized to use this bot.")
             return
 
-        # Add to queue
         file_name = message.video.file_name or f"video_{message.video.file_unique_id}.mp4"
+
+        # Hydrax would refuse it anyway, don't spend a download on it
+        if (message.video.file_size or 0) > MAX_FILE_SIZE:
+            await message.reply_text("❌ File exceeds 10GB limit")
+            return
+
+        # Answer straight away if this exact file was uploaded before
+        slug = dedup.lookup([dedup.telegram_key(message.video.file_unique_id)])
+        if slug:
+            await message.reply_text(self._already_uploaded_text(file_name, slug))
+            return
+
+        # Add to queue
         db.add_to_queue({
             'type': 'telegram',
             'file_name': file_name,
             'file_id': message.video.file_id,
+            'file_unique_id': message.video.file_unique_id,
+            'file_size': message.video.file_size,
+            'mime_type': message.video.mime_type,
             'user_id': user_id,
             'chat_id': message.chat.id
         })
 
         await message.reply_text("📋 Added to processing queue!")
 
-        # Process queue if not already processing
-        if not self.processing:
-            asyncio.create_task(self.process_queue())
+        # Make sure a worker picks up the new item
+        self.wake_workers()
 
     async def handle_url(self, client: Client, message: Message):
         """Handle URL messages"""
         user_id = message.from_user.id
 
         # Check authorization
-        if user_id != int(os.getenv('CREATOR_ID')) and user_id not in db.get_users():
+        if user_id != int(os.getenv('CREATOR_ID')) and not db.is_authorized(user_id):
             await message.reply_text("❌ You are not authorized to use this bot.")
             return
 
         url = message.text.strip()
 
+        # Answer straight away if the server reports the same file we uploaded before
+        url_key, file_size = await self._probe_url(url)
+        slug = dedup.lookup([url_key])
+        if slug:
+            await message.reply_text(self._already_uploaded_text(url.split('/')[-1] or url, slug))
+            return
+
         # Add to queue
         db.add_to_queue({
             'type': 'url',
             'url': url,
+            'url_key': url_key,
+            'file_size': file_size,
             'user_id': user_id,
             'chat_id': message.chat.id
         })
 
         await message.reply_text("📋 Added to processing queue!")
 
-        # Process queue if not already processing
-        if not self.processing:
-            asyncio.create_task(self.process_queue())
-
-    async def process_queue(self):
-        """Process the upload queue"""
-        if self.processing:
-            return
-
-        self.processing = True
+        # Make sure a worker picks up the new item
+        self.wake_workers()
 
+    async def _probe_url(self, url: str) -> Tuple[Optional[str], int]:
+        """Get the dedup key and size of a URL from its headers"""
         try:
-            while True:
-                queue = db.get_queue()
-                if not queue:
-                    break
-
-                item = queue[0]
-                user_id = item['user_id']
-                chat_id = item['chat_id']
-
-                try:
-                    if item['type'] == 'telegram':
-                        await self.process_telegram_item(item, chat_id)
-                    else:
-                        await self.process_url_item(item, chat_id)
-                except Exception as e:
-                    logger.error(f"Error processing item: {e}")
-                    await self.bot.send_message(chat_id, f"❌ Error: {str(e)}")
+            size, _, validators = await SegmentedDownloader().probe(
+                url, timeout=aiohttp.ClientTimeout(total=10), retry=False
+            )
+        except Exception as e:
+            logger.warning(f"Could not probe {url}: {e}")
+            return None, 0
+        return dedup.url_key(url, validators['etag'], validators['last_modified'], size), size
+
+    def _already_uploaded_text(self, file_name: str, slug: str) -> str:
+        """Reply for content that was uploaded before"""
+        return (
+            f"✅ Already uploaded!\n\n"
+            f"**File:** {file_name}\n"
+            f"**URL:** https://hydrax.net/{slug}"
+        )
+
+    def wake_workers(self):
+        """Start idle workers so pending queue items get picked up"""
+        if not self.run_workers:
+            return
 
-                # Remove completed item
-                db.remove_from_queue(0)
+        for worker_id in range(1, self.worker_count + 1):
+            task = self.worker_tasks.get(worker_id)
+            if task is None or task.done():
+                self.worker_tasks[worker_id] = asyncio.create_task(self._worker(worker_id))
 
-        finally:
-            self.processing = False
+    async def process_queue(self):
+        """Process the upload queue until it is drained"""
+        self.wake_workers()
+        while any(not task.done() for task in self.worker_tasks.values()):
+            await asyncio.gather(*self.worker_tasks.values(), return_exceptions=True)
+
+    def scheduled_queue(self, offset: int, limit: int, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get a slice of the queue in the order it will be worked through
+
+        Items held by workers come first, then each user's window of ready
+        items in the scheduler order claims use, then the rest of the
+        pending items from the database, so a page never loads the whole
+        queue.
+        """
+        active = db.active_items()
+        head = [item for item in active if user_id is None or item['user_id'] == user_id]
+        head += self.scheduler.order(db.ready_items(self.schedule_window, user_id), active)
+
+        items = head[offset:offset + limit]
+        if len(items) < limit:
+            items += db.queue_tail(max(0, offset - len(head)), limit - len(items), self.schedule_window, user_id)
+        return items
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """Claim the first item in scheduler order that no other worker got to first
+
+        Only each user's oldest SCHEDULER_WINDOW ready items are ordered, so
+        a claim costs the same however long the queue grows.
+        """
+        ready = db.ready_items(self.schedule_window)
+        for candidate in self.scheduler.order(ready, db.active_items()):
+            item = db.claim_queue_item(candidate['id'], self.worker_name, self.lease)
+            if item is not None:
+                self.scheduler.served(item)
+                return item
+        return None
+
+    def next_item(self, user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Get the item workers will claim next, ordered the same way as claims"""
+        ready = db.ready_items(self.schedule_window, user_id)
+        ordered = self.scheduler.order(ready, db.active_items())
+        return ordered[0] if ordered else None
+
+    def _next_item_text(self) -> str:
+        """Describe the next item for the progress footer"""
+        next_item = self.next_item()
+        return get_next_queue_item([next_item] if next_item else [], [])
+
+    def estimate_drain_time(self, total_bytes: int) -> Optional[float]:
+        """Estimate how long the workers need for total_bytes from the last hour's median speeds"""
+        seconds_per_byte = 0.0
+        for stage in ('download', 'upload'):
+            count, speeds = metrics.percentiles('hydrax_transfer_speed_bytes', 3600, (50,), stage=stage)
+            if not count or not speeds[0]:
+                return None
+            seconds_per_byte += 1 / speeds[0]
+        return total_bytes * seconds_per_byte / self.worker_count
+
+    def active_ids(self) -> List[str]:
+        """Get ids of the queue items currently held by workers"""
+        return [state['item']['id'] for state in self.workers.values()]
+
+    def start_supervisor(self):
+        """Keep leases renewed and the queue polled in the background"""
+        if self.supervisor is None or self.supervisor.done():
+            self.supervisor = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        """Renew our leases, reclaim items of dead workers and pick up new items"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self._renew_leases()
+                reclaimed = db.reclaim_expired_leases()
+                if reclaimed:
+                    logger.warning(f"Reclaimed {reclaimed} items from workers that stopped responding")
+                self.wake_workers()
+            except Exception as e:
+                logger.error(f"Queue supervisor error: {e}")
+
+    def _renew_leases(self):
+        """Extend the leases of running items and stop the ones we no longer hold"""
+        tasks = {
+            state['item']['id']: state['task'] for state in self.workers.values()
+            if state['item']['id'] not in self.finished
+        }
+        for item_id in db.renew_leases(self.worker_name, list(tasks), self.lease):
+            if db.get_queue_item(item_id) is None:
+                # Removed by /cancel, possibly from another process
+                self.cancelled.add(item_id)
+            else:
+                # Our lease ran out and the item went back to the queue, leave its files alone
+                logger.warning(f"Lost the lease on {item_id}, stopping it")
+                self.lost.add(item_id)
+            tasks[item_id].cancel()
+
+    async def stop(self):
+        """Stop the supervisor and running items, handing the items back to the queue"""
+        tasks = [state['task'] for state in self.workers.values()] + list(self.worker_tasks.values())
+        if self.supervisor:
+            tasks.append(self.supervisor)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        db.requeue_active_items(self.worker_name)
+
+    def get_worker_status(self) -> List[str]:
+        """Describe which worker holds which item"""
+        lines = []
+        for worker_id in range(1, self.worker_count + 1 if self.run_workers else 1):
+            state = self.workers.get(worker_id)
+            if state is None:
+                lines.append(f"👷 Worker {worker_id}: idle")
+            else:
+                elapsed = time.time() - state['since']
+                lines.append(
+                    f"👷 Worker {worker_id}: {state['stage']} "
+                    f"{self._item_file_name(state['item'])} ({elapsed:.0f}s)"
+                )
+
+        # Items held by worker processes
+        now = time.time()
+        for item in db.active_items():
+            if item['worker'] != self.worker_name:
+                lease = f"lease {item['lease_until'] - now:.0f}s" if item['lease_until'] else "no lease"
+                lines.append(f"👷 {item['worker'] or 'unknown'}: {self._item_file_name(item)} ({lease})")
+
+        return lines or ["👷 No workers are busy"]
+
+    def _collect_metrics(self):
+        """Refresh the queue and worker gauges"""
+        counts = db.queue_counts()
+        for status in ('pending', 'active', 'failed'):
+            metrics.set('hydrax_queue_items', counts.get(status, 0), status=status)
+        metrics.set('hydrax_workers_busy', len(self.workers))
+
+    def _record_transfer(self, stage: str, started: float, size: int):
+        """Record the duration and average speed of a finished transfer"""
+        elapsed = time.monotonic() - started
+        metrics.observe('hydrax_transfer_seconds', elapsed, stage=stage)
+        metrics.inc('hydrax_transfer_bytes_total', size, stage=stage)
+        if elapsed > 0:
+            metrics.observe('hydrax_transfer_speed_bytes', size / elapsed, stage=stage)
+        logger.info(
+            f"{stage.title()} of {size} bytes took {elapsed:.1f}s",
+            extra={'stage': stage, 'duration': round(elapsed, 3), 'bytes': size}
+        )
+
+    def _set_stage(self, worker_id: int, stage: str):
+        """Record the stage a worker has reached"""
+        self.workers[worker_id]['stage'] = stage
+        self.workers[worker_id]['since'] = time.time()
+
+    async def _worker(self, worker_id: int):
+        """Claim and process queue items until none are left"""
+        while True:
+            item = self._claim_next()
+            if item is None:
+                # Come back for items that are waiting out a retry delay
+                delay = db.next_retry_delay()
+                if delay:
+                    asyncio.get_running_loop().call_later(delay, self.wake_workers)
+                break
+
+            # Lines logged while handling the item carry its id in JSON logs
+            set_log_context(item_id=item['id'], user_id=item['user_id'], worker=self.worker_name)
+
+            # Each item runs in its own task so /cancel can stop it without the worker
+            task = asyncio.create_task(self.process_item(worker_id, item))
+            self.workers[worker_id] = {'item': item, 'task': task, 'stage': 'starting', 'since': time.time()}
+            metrics.observe('hydrax_queue_wait_seconds', time.time() - item['created_at'])
+
+            try:
+                await task
+            except asyncio.CancelledError:
+                if item['id'] in self.cancelled:
+                    self._discard_transfer(item)
+                    metrics.inc('hydrax_items_total', outcome='cancelled')
+                    logger.info(f"Cancelled {self._item_file_name(item)}")
+                elif item['id'] not in self.lost:
+                    raise
+            except Exception as e:
+                logger.error(f"Error processing item: {e}")
+                if self._retry_or_fail(item, e) is None:
+                    # A blocked bot or a FloodWait here must not take the worker down
+                    try:
+                        await self.bot.send_message(item['chat_id'], f"❌ Error: {str(e)}")
+                    except Exception as notify_error:
+                        logger.warning(f"Failed to send error message to {item['chat_id']}: {notify_error}")
+            finally:
+                self.cancelled.discard(item['id'])
+                self.lost.discard(item['id'])
+                self.finished.discard(item['id'])
+                storage.release(item['id'])
+                del self.workers[worker_id]
+
+    def cancel_user_items(self, user_id: int) -> int:
+        """Drop every queue item of a user and abort the ones being transferred"""
+        held = {item['id'] for item in db.active_items() if item['user_id'] == user_id}
+        item_ids = db.remove_user_items(user_id)
+
+        active = {}
+        for state in self.workers.values():
+            if state['item']['id'] in item_ids:
+                active[state['item']['id']] = state['task']
+
+        for item_id in item_ids:
+            if item_id in active:
+                # The worker removes the temp file once the task has unwound
+                self.cancelled.add(item_id)
+                active[item_id].cancel()
+            elif item_id not in held:
+                self._discard_transfer({'id': item_id})
+            # Items held by another process are stopped and cleaned up on its next lease renewal
+
+        return len(item_ids)
+
+    def _complete_item(self, item: dict):
+        """Forget a finished item and its temp file"""
+        self._discard_transfer(item)
+        db.remove_queue_item(item['id'])
+        self.finished.add(item['id'])
+
+    def _retry_or_fail(self, item: dict, error: Exception) -> Optional[float]:
+        """Schedule a retry with exponential backoff, or return None once attempts run out"""
+        attempts = item.get('attempts', 0) + 1
+        # The row is handed back below, keep the supervisor from taking that as a lost lease
+        self.finished.add(item['id'])
+
+        if attempts >= self.max_attempts or isinstance(error, (StorageRejected, InvalidMedia)):
+            self._discard_transfer(item)
+            db.fail_queue_item(item['id'], str(error))
+            metrics.inc('hydrax_items_total', outcome='failed')
+            return None
+
+        delay = self.retry_backoff * 2 ** (attempts - 1)
+        db.retry_queue_item(item['id'], str(error), delay)
+        metrics.inc('hydrax_items_total', outcome='retried')
+        asyncio.get_running_loop().call_later(delay, self.wake_workers)
+        return delay
+
+    def _discard_transfer(self, item: dict):
+        """Remove the partial file and saved transfer state of an item"""
+        state = db.get_transfer(item['id'])
+        if state and state.get('path') and os.path.exists(state['path']):
+            os.remove(state['path'])
+        db.delete_transfer(item['id'])
+
+    def _item_file_name(self, item: dict) -> str:
+        """Get the name a queue item is uploaded under"""
+        if item['type'] == 'telegram':
+            return item['file_name']
+        return item['url'].split('/')[-1] or "video.mp4"
+
+    async def process_item(self, worker_id: int, item: dict):
+        """Run a queue item through the download and upload stages"""
+        chat_id = item['chat_id']
+        file_name = self._item_file_name(item)
+        file_path = None
+
+        if item['type'] == 'telegram':
+            status_msg = await self.bot.send_message(chat_id, f"📥 Downloading {file_name}...")
+        else:
+            status_msg = await self.bot.send_message(chat_id, f"📥 Downloading from URL...")
+
+        reporter = ProgressReporter(
+            status_msg,
+            file_name,
+            footer=self._next_item_text
+        )
+
+        # Retries pick up the saved state and skip or resume the download
+        state = db.get_transfer(item['id']) or {}
 
-    async def process_telegram_item(self, item: dict, chat_id: int):
-        """Process Telegram video upload"""
-        file_name = item['file_name']
+        try:
+            result = None
 
-        # Download using userbot
-        status_msg = await self.bot.send_message(chat_id, f"📥 Downloading {file_name}...")
+            async with self.download_slots:
+                self._set_stage(worker_id, 'downloading')
 
-        try:
-            start_time = time.time()
+                if self.relay_mode and not state:
+                    # A relay occupies both stages at once
+                    async with self.upload_slots:
+                        self._set_stage(worker_id, 'relaying')
+                        result = await self._try_relay(item, file_name, reporter)
 
-            async def progress(current, total):
-                bar = create_progress_bar(current, total)
-                percentage = (current / total) * 100
-                elapsed = time.time() - start_time
-                speed = format_bytes(current / elapsed) if elapsed > 0 else "0 B"
-                eta = f"{(total - current) / (current / elapsed):.1f}s" if current > 0 else "∞"
+                if result is None:
+                    self._set_stage(worker_id, 'downloading')
+                    file_path = await self.download_item(item, file_name, reporter, state)
 
+            if result is None and 'media' not in state:
+                # Catch error pages and broken files before they cost an upload
+                self._set_stage(worker_id, 'probing')
                 try:
-                    await status_msg.edit_text(
-                        f"📥 Downloading...\n\n"
-                        f"**File:** {file_name}\n"
-                        f"**Progress:** {bar} {percentage:.1f}%\n"
-                        f"**Speed:** {speed}/s\n"
-                        f"**ETA:** {eta}\n\n"
-                        f"**Next:** {get_next_queue_item(db.get_queue())}"
+                    state['media'] = await media_prober.inspect(file_path)
+                except TruncatedMedia:
+                    # The next attempt downloads the file again from scratch
+                    self._discard_transfer(item)
+                    raise
+                db.save_transfer(item['id'], state)
+                if state['media']:
+                    logger.info(
+                        f"Probed {file_name}: {self._describe_media(state['media'])}",
+                        extra={'duration': state['media'].get('duration')}
                     )
-                except Exception:
-                    pass
-
-            file_path = await userbot.download_media(
-                item['file_id'],
-                file_name=file_name,
-                progress=progress
-            )
-
-            if not file_path:
-                raise Exception("Failed to download file")
-
-            # Check file size (10GB limit)
-            file_size = os.path.getsize(file_path)
-            if file_size > 10 * 1024 * 1024 * 1024:  # 10GB
-                raise Exception("File exceeds 10GB limit")
-
-            # Upload to Hydrax
-            await status_msg.edit_text(f"📤 Uploading to Hydrax...")
-
-            result = hydrax_api.upload_video(file_path, file_name)
-
-            # Clean up
-            if os.path.exists(file_path):
-                os.remove(file_path)
 
-            await status_msg.edit_text(
-                f"✅ Upload completed!\n\n"
+            if result is None:
+                # The same bytes may have arrived before under another name or URL
+                if not state.get('sha256'):
+                    loop = asyncio.get_running_loop()
+                    state['sha256'] = await loop.run_in_executor(None, hash_file, file_path)
+                    db.save_transfer(item['id'], state)
+
+                slug = dedup.lookup([dedup.content_key(state['sha256'])])
+                if slug:
+                    result = {'slug': slug, 'deduplicated': True}
+
+            if result is None:
+                self._set_stage(worker_id, 'waiting for upload')
+                await reporter.update(f"⏳ Waiting for an upload slot...\n\n**File:** {file_name}")
+
+                async with self.upload_slots:
+                    self._set_stage(worker_id, 'uploading')
+                    mime_type = self._mime_type(file_name, (state.get('media') or {}).get('mime_type'))
+                    result = await self._upload_file(file_path, file_name, reporter, mime_type)
+
+        except InsufficientStorage as e:
+            # Not the item's fault, wait for space without using up an attempt
+            delay = storage.retry_delay
+            self.finished.add(item['id'])
+            db.defer_queue_item(item['id'], delay)
+            asyncio.get_running_loop().call_later(delay, self.wake_workers)
+            await reporter.update(
+                f"💾 Waiting for disk space: {str(e)}\n\n"
                 f"**File:** {file_name}\n"
-                f"**URL:** https://hydrax.net/{result.get('slug', 'N/A')}"
+                f"🔁 Checking again in {delay:.0f}s..."
             )
-
+            logger.info(f"Deferred {file_name} for {delay:.0f}s: {e}")
+            return
+        except asyncio.CancelledError:
+            if item['id'] in self.cancelled:
+                await reporter.update(f"🚫 Cancelled\n\n**File:** {file_name}")
+            raise
         except Exception as e:
-            await status_msg.edit_text(f"❌ Upload failed: {str(e)}")
-            logger.error(f"Upload failed: {e}")
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
-
-    async def process_url_item(self, item: dict, chat_id: int):
-        """Process URL upload"""
-        url = item['url']
-        file_name = url.split('/')[-1] or "video.mp4"
+            delay = self._retry_or_fail(item, e)
+            if delay is None:
+                await reporter.update(f"❌ Upload failed: {str(e)}")
+                logger.error(f"Upload failed: {e}")
+            else:
+                await reporter.update(
+                    f"⚠️ Upload failed: {str(e)}\n\n"
+                    f"🔁 Retrying in {delay:.0f}s..."
+                )
+                logger.warning(f"Upload of {file_name} failed, retrying in {delay:.0f}s: {e}")
+            return
 
-        status_msg = await self.bot.send_message(chat_id, f"📥 Downloading from URL...")
+        dedup.remember(
+            [
+                item.get('file_unique_id') and dedup.telegram_key(item['file_unique_id']),
+                item.get('url_key'),
+                state.get('sha256') and dedup.content_key(state['sha256'])
+            ],
+            result.get('slug'),
+            item.get('file_size') or state.get('size') or 0
+        )
+        self._complete_item(item)
+        metrics.inc('hydrax_items_total', outcome='deduplicated' if result.get('deduplicated') else 'completed')
+
+        await reporter.update(
+            f"✅ Upload completed!\n\n"
+            f"**File:** {file_name}\n"
+            f"**URL:** https://hydrax.net/{result.get('slug', 'N/A')}"
+        )
+
+    async def download_item(self, item: dict, file_name: str, reporter: ProgressReporter, state: dict) -> str:
+        """Download an item to disk, resuming from its saved transfer state"""
+        file_path = state.setdefault('path', storage.path(item['id'], file_name))
+
+        if state.get('complete') and os.path.exists(file_path):
+            return file_path
+
+        # Check the size up front instead of after a download that can't be uploaded
+        file_size = item.get('file_size') or 0
+        if file_size > MAX_FILE_SIZE:
+            raise StorageRejected("File exceeds 10GB limit")
+        storage.reserve(item['id'], file_path, file_size)
+
+        state['complete'] = False
+        db.save_transfer(item['id'], state)
+
+        started = time.monotonic()
+        if item['type'] == 'telegram':
+            await self.download_telegram_item(item, file_path, reporter, state)
+        else:
+            await self.download_url_item(item, file_path, reporter, state)
+
+        state['complete'] = True
+        db.save_transfer(item['id'], state)
+        self._record_transfer('download', started, os.path.getsize(file_path))
+        return file_path
+
+    async def download_telegram_item(self, item: dict, file_path: str, reporter: ProgressReporter, state: dict):
+        """Download a Telegram video through the least busy userbot session"""
+        progress = reporter.phase("📥 Downloading...")
+        while True:
+            async with userbot_pool.acquire() as session:
+                try:
+                    await TelegramDownloader(session).download(
+                        item['file_id'],
+                        file_path,
+                        item.get('file_size') or 0,
+                        progress=progress,
+                        state=state,
+                        on_checkpoint=lambda state: db.save_transfer(item['id'], state)
+                    )
+                    return
+                except FloodWait:
+                    # The session is out of rotation now, resume from the checkpoint on another one
+                    logger.info(f"Switching userbot session for {item['file_name']} after FloodWait")
+
+    async def download_url_item(self, item: dict, file_path: str, reporter: ProgressReporter, state: dict):
+        """Download a URL to a temp file"""
+        await SegmentedDownloader().download(
+            item['url'],
+            file_path,
+            progress=reporter.phase("📥 Downloading..."),
+            on_segments=reporter.set_segments,
+            state=state,
+            on_checkpoint=lambda state: db.save_transfer(item['id'], state)
+        )
+
+    async def _try_relay(self, item: dict, file_name: str, reporter: ProgressReporter) -> Optional[dict]:
+        """Relay an item without touching disk, or return None to use the disk path"""
+        if item['type'] == 'telegram':
+            file_size = item.get('file_size')
+            if not file_size:
+                return None
+            async with userbot_pool.acquire() as session:
+                return await self._relay(
+                    session.stream_media(item['file_id']), file_name, file_size, reporter,
+                    self._mime_type(file_name, item.get('mime_type'))
+                )
+
+        async with http_client.get(item['url']) as response:
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status}")
+
+            total_size = int(response.headers.get('content-length', 0))
+            if total_size <= 0:
+                return None
+
+            # Relayed bytes can't be probed, let the disk path check (and reject) non-video replies
+            content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+            if content_type.startswith(('text/', 'application/json', 'application/xml')):
+                return None
+
+            return await self._relay(
+                response.content.iter_chunked(hydrax_api.chunk_size),
+                file_name, total_size, reporter, self._mime_type(file_name, content_type)
+            )
 
+    @staticmethod
+    def _mime_type(file_name: str, declared: Optional[str] = None) -> str:
+        """Pick the Content-Type to upload with, from the probe or source when it names a video"""
+        if declared and declared.startswith('video/'):
+            return declared
+        guessed = mimetypes.guess_type(file_name)[0]
+        if guessed and guessed.startswith('video/'):
+            return guessed
+        return 'video/mp4'
+
+    @staticmethod
+    def _describe_media(media: dict) -> str:
+        """Summarize a probe result for the log"""
+        parts = [media['container']]
+        if media.get('video_codec'):
+            parts.append(media['video_codec'])
+        if media.get('width'):
+            parts.append(f"{media['width']}x{media['height']}")
+        if media.get('audio_codec'):
+            parts.append(media['audio_codec'])
+        if media.get('duration') is not None:
+            parts.append(f"{media['duration']:.0f}s")
+        return ", ".join(parts)
+
+    async def _upload_file(self, file_path: str, file_name: str, reporter: ProgressReporter, mime_type: str = 'video/mp4') -> dict:
+        """Upload a downloaded file to Hydrax"""
+        # Check file size (10GB limit)
+        file_size = os.path.getsize(file_path)
+        if file_size > MAX_FILE_SIZE:
+            raise Exception("File exceeds 10GB limit")
+
+        started = time.monotonic()
+        result = await hydrax_api.upload_video(
+            file_path,
+            file_name,
+            progress=reporter.phase("📤 Uploading to Hydrax..."),
+            mime_type=mime_type
+        )
+        self._record_transfer('upload', started, file_size)
+        return result
+
+    async def _relay(self, source, file_name: str, file_size: int, reporter: ProgressReporter, mime_type: str = 'video/mp4'):
+        """Pipe a download straight into the Hydrax upload, or return None to use the disk path"""
+        if file_size > MAX_FILE_SIZE:
+            raise Exception("File exceeds 10GB limit")
+
+        started = time.monotonic()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        raise Exception(f"HTTP {response.status}")
-
-                    total_size = int(response.headers.get('content-length', 0))
-                    downloaded = 0
-                    start_time = time.time()
-
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file_name}") as tmp_file:
-                        file_path = tmp_file.name
-
-                        async for chunk in response.content.iter_chunked(8192):
-                            if chunk:
-                                tmp_file.write(chunk)
-                                downloaded += len(chunk)
-
-                                if total_size > 0:
-                                    bar = create_progress_bar(downloaded, total_size)
-                                    percentage = (downloaded / total_size) * 100
-                                    elapsed = time.time() - start_time
-                                    speed = format_bytes(downloaded / elapsed) if elapsed > 0 else "0 B"
-                                    eta = f"{(total_size - downloaded) / (downloaded / elapsed):.1f}s" if downloaded > 0 else "∞"
-
-                                    try:
-                                        await status_msg.edit_text(
-                                            f"📥 Downloading...\n\n"
-                                            f"**File:** {file_name}\n"
-                                            f"**Progress:** {bar} {percentage:.1f}%\n"
-                                            f"**Speed:** {speed}/s\n"
-                                            f"**ETA:** {eta}\n\n"
-                                            f"**Next:** {get_next_queue_item(db.get_queue())}"
-                                        )
-                                    except Exception:
-                                        pass
-
-                        tmp_file.flush()
-
-                        # Check file size (10GB limit)
-                        file_size = os.path.getsize(file_path)
-                        if file_size > 10 * 1024 * 1024 * 1024:  # 10GB
-                            raise Exception("File exceeds 10GB limit")
-
-                        # Upload to Hydrax
-                        await status_msg.edit_text(f"📤 Uploading to Hydrax...")
-
-                        result = hydrax_api.upload_video(file_path, file_name)
-
-                        # Clean up
-                        os.remove(file_path)
-
-                        await status_msg.edit_text(
-                            f"✅ Upload completed!\n\n"
-                            f"**File:** {file_name}\n"
-                            f"**URL:** https://hydrax.net/{result.get('slug', 'N/A')}"
-                        )
-
+            result = await relay(
+                source,
+                lambda chunks: hydrax_api.upload_stream(
+                    chunks,
+                    file_name,
+                    file_size,
+                    progress=reporter.phase("🔀 Relaying to Hydrax..."),
+                    mime_type=mime_type
+                ),
+                self.relay_buffer_size
+            )
         except Exception as e:
-            await status_msg.edit_text(f"❌ Upload failed: {str(e)}")
-            logger.error(f"Upload failed: {e}")
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
+            logger.warning(f"Relay of {file_name} failed, falling back to disk: {e}")
+            return None
+
+        self._record_transfer('relay', started, file_size)
+        return result
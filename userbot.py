@@ -1,18 +1,179 @@
 from pyrogram import Client
+from pyrogram.errors import FloodWait
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+import asyncio
 import os
+import time
+from utils.logger import logger
+from utils.metrics import metrics
 
-# Userbot for downloading files
-userbot = Client(
-    "userbot",
-    api_id=2040,
-    api_hash="b18441a1ff607e10a989891a5462e627",
-    session_string=os.getenv('SESSION_STRING')
-)
+def max_transmissions() -> int:
+    """Get how many get_file streams each userbot client may run at once
+
+    pyrogram holds a semaphore of this size for the whole life of every
+    stream_media call and defaults it to 1, which would run the stripes of
+    a parallel download one after another. Enough for every stripe of
+    every worker by default.
+    """
+    parts = int(os.getenv('TELEGRAM_DOWNLOAD_PARTS') or 4)
+    workers = int(os.getenv('QUEUE_WORKERS') or 2)
+    return int(os.getenv('USERBOT_MAX_TRANSMISSIONS') or parts * workers)
+
+class UserbotSession:
+    """One userbot account in the pool, with its load and FloodWait state"""
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client
+        self.active = 0
+        self.bytes = 0
+        self.flood_until = 0.0
+        self.healthy = True
+
+    @property
+    def max_concurrent_transmissions(self) -> int:
+        return getattr(self.client, 'max_concurrent_transmissions', 1)
+
+    def available(self) -> bool:
+        return self.healthy and time.monotonic() >= self.flood_until
+
+    def flood_wait(self, seconds: float):
+        """Take the session out of rotation while Telegram asks us to wait"""
+        self.flood_until = max(self.flood_until, time.monotonic() + seconds)
+        metrics.inc('hydrax_floodwaits_total', source='userbot')
+        metrics.inc('hydrax_floodwait_seconds_total', seconds, source='userbot')
+        logger.warning(f"Userbot session {self.name} is under FloodWait for {seconds}s")
+
+    async def stream_media(self, file_id: str, limit: int = 0, offset: int = 0) -> AsyncIterator[bytes]:
+        """Stream media through this account, counting the bytes it moves"""
+        try:
+            async for chunk in self.client.stream_media(file_id, limit=limit, offset=offset):
+                self.bytes += len(chunk)
+                metrics.inc('hydrax_userbot_bytes_total', len(chunk), session=self.name)
+                yield chunk
+        except FloodWait as e:
+            self.flood_wait(e.value)
+            raise
+
+    async def download_media(self, *args, **kwargs):
+        """Download media through this account with pyrogram's own downloader"""
+        try:
+            path = await self.client.download_media(*args, **kwargs)
+        except FloodWait as e:
+            self.flood_wait(e.value)
+            raise
+
+        if path:
+            size = os.path.getsize(path)
+            self.bytes += size
+            metrics.inc('hydrax_userbot_bytes_total', size, session=self.name)
+        return path
+
+class UserbotPool:
+    """Userbot accounts that Telegram downloads are spread across
+
+    Each download goes to the least busy session that isn't under
+    FloodWait, so every account's bandwidth and flood budget is used.
+    """
+
+    def __init__(self, clients: List):
+        self.sessions = [
+            UserbotSession("userbot" if i == 0 else f"userbot_{i + 1}", client)
+            for i, client in enumerate(clients)
+        ]
+        self.max_wait = float(os.getenv('USERBOT_MAX_WAIT') or 300)
+
+    @classmethod
+    def from_env(cls) -> "UserbotPool":
+        """Create a client for each of SESSION_STRINGS, or for SESSION_STRING alone"""
+        strings = [s.strip() for s in (os.getenv('SESSION_STRINGS') or '').split(',') if s.strip()]
+        if not strings:
+            strings = [os.getenv('SESSION_STRING')]
+
+        return cls([
+            Client(
+                "userbot" if i == 0 else f"userbot_{i + 1}",
+                api_id=2040,
+                api_hash="b18441a1ff607e10a989891a5462e627",
+                session_string=session_string,
+                max_concurrent_transmissions=max_transmissions()
+            )
+            for i, session_string in enumerate(strings)
+        ])
+
+    async def start(self):
+        """Start every session, keeping the ones that fail out of rotation"""
+        for session in self.sessions:
+            try:
+                await session.client.start()
+            except Exception as e:
+                session.healthy = False
+                logger.error(f"Userbot session {session.name} failed to start: {e}")
+
+        if not any(session.healthy for session in self.sessions):
+            raise RuntimeError("No userbot session could be started")
+
+    async def stop(self):
+        """Stop every running session"""
+        for session in self.sessions:
+            if session.healthy:
+                await session.client.stop()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[UserbotSession]:
+        """Hold the least busy available session for one transfer"""
+        session = await self._pick()
+        session.active += 1
+        try:
+            yield session
+        finally:
+            session.active -= 1
+
+    async def _pick(self) -> UserbotSession:
+        while True:
+            available = [session for session in self.sessions if session.available()]
+            if available:
+                return min(available, key=lambda session: (session.active, session.bytes))
+
+            waiting = [session for session in self.sessions if session.healthy]
+            if not waiting:
+                raise RuntimeError("No userbot session is available")
+
+            delay = min(session.flood_until for session in waiting) - time.monotonic()
+            if delay > self.max_wait:
+                raise FloodWait(value=int(delay))
+            await asyncio.sleep(max(delay, 0))
+
+    def status(self) -> List[str]:
+        """Describe each session's load, throughput and FloodWait"""
+        lines = []
+        for session in self.sessions:
+            if not session.healthy:
+                lines.append(f"🤖 {session.name}: ❌ not running")
+                continue
+
+            speed = metrics.total('hydrax_userbot_bytes_total', 60, session=session.name) / 60
+            line = (
+                f"🤖 {session.name}: {session.active} active, "
+                f"{session.bytes / 1024 ** 3:.2f} GB total, {speed / 1024 ** 2:.1f} MB/s (1m)"
+            )
+            wait = session.flood_until - time.monotonic()
+            if wait > 0:
+                line += f", ⏳ FloodWait {wait:.0f}s"
+            lines.append(line)
+        return lines
+
+# Userbots for downloading files
+userbot_pool = UserbotPool.from_env()
+userbot = userbot_pool.sessions[0].client
+
+metrics.counter('hydrax_userbot_bytes_total', "Bytes downloaded through each userbot session")
 
 async def start_userbot():
     """Start the userbot"""
-    await userbot.start()
+    await userbot_pool.start()
 
 async def stop_userbot():
     """Stop the userbot"""
-    await userbot.stop()
+    await userbot_pool.stop()
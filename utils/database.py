@@ -1,102 +1,610 @@
 import json
 import os
-from typing import Dict, List, Any
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Set
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    added_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+    user_id INTEGER PRIMARY KEY,
+    language TEXT NOT NULL DEFAULT 'en'
+);
+
+CREATE TABLE IF NOT EXISTS config (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    worker TEXT,
+    lease_until REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_queue_user ON queue (user_id, status, seq);
+CREATE INDEX IF NOT EXISTS idx_queue_status ON queue (status, seq);
+
+CREATE TABLE IF NOT EXISTS transfers (
+    item_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'sending',
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    PRIMARY KEY (broadcast_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_recipients_status ON broadcast_recipients (broadcast_id, status);
+
+CREATE TABLE IF NOT EXISTS blocked_users (
+    user_id INTEGER PRIMARY KEY,
+    reason TEXT NOT NULL,
+    blocked_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dedup (
+    key TEXT PRIMARY KEY,
+    slug TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_dedup_last_used ON dedup (last_used);
+"""
 
 class Database:
-    def __init__(self):
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('DATABASE_FILE') or 'bot.db'
+
+        # JSON files used by older versions, imported once on first start
         self.users_file = 'users.json'
         self.settings_file = 'settings.json'
         self.queue_file = 'queue.json'
-        
-        # Initialize files if they don't exist
+
+        # Worker processes share the file, wait for their write locks instead of failing
+        self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+        self._migrate_json()
+
+        # Read cache for the per-message hot path (authorization and language)
+        self.cache_check_interval = float(os.getenv('DB_CACHE_CHECK_INTERVAL') or 1)
+        self._users: Optional[Set[int]] = None
+        self._languages: Optional[Dict[int, str]] = None
+        self._data_version = None
+        self._checked_at = 0.0
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements atomically"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        else:
+            self.conn.execute("COMMIT")
+
+    def _migrate_json(self):
+        """Import users, settings and queue from the legacy JSON files"""
+        legacy = {}
         for file in [self.users_file, self.settings_file, self.queue_file]:
-            if not os.path.exists(file):
-                with open(file, 'w') as f:
-                    json.dump({}, f)
-    
+            if os.path.exists(file):
+                with open(file, 'r') as f:
+                    try:
+                        legacy[file] = json.load(f)
+                    except ValueError:
+                        legacy[file] = {}
+
+        if not legacy:
+            return
+
+        now = time.time()
+        with self.transaction() as conn:
+            for user_id in legacy.get(self.users_file, {}).get('authorized_users', []):
+                conn.execute(
+                    "INSERT OR IGNORE INTO users (user_id, added_at) VALUES (?, ?)",
+                    (int(user_id), now)
+                )
+
+            for user_id, settings in legacy.get(self.settings_file, {}).items():
+                if 'language' in settings:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO settings (user_id, language) VALUES (?, ?)",
+                        (int(user_id), settings['language'])
+                    )
+
+            for item in legacy.get(self.queue_file, {}).get('queue', []):
+                self._insert_queue_item(conn, item)
+
+        # Keep the old files around, but never import them twice
+        for file in legacy:
+            os.replace(file, f"{file}.migrated")
+
+    def _check_cache(self):
+        """Drop cached reads if another connection changed the database"""
+        now = time.monotonic()
+        if now - self._checked_at < self.cache_check_interval:
+            return
+        self._checked_at = now
+
+        # data_version only changes when a different connection commits
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._users = None
+            self._languages = None
+
+    def _cached_users(self) -> Set[int]:
+        """Get the cached set of authorized users"""
+        self._check_cache()
+        if self._users is None:
+            rows = self.conn.execute("SELECT user_id FROM users").fetchall()
+            self._users = {row['user_id'] for row in rows}
+        return self._users
+
+    def is_authorized(self, user_id: int) -> bool:
+        """Check if a user is authorized"""
+        return user_id in self._cached_users()
+
     def get_users(self) -> List[int]:
         """Get all authorized users"""
-        with open(self.users_file, 'r') as f:
-            data = json.load(f)
-            return list(data.get('authorized_users', []))
-    
+        return list(self._cached_users())
+
     def add_user(self, user_id: int):
         """Add authorized user"""
-        with open(self.users_file, 'r') as f:
-            data = json.load(f)
-        
-        if 'authorized_users' not in data:
-            data['authorized_users'] = []
-        
-        if user_id not in data['authorized_users']:
-            data['authorized_users'].append(user_id)
-        
-        with open(self.users_file, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        self.conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, added_at) VALUES (?, ?)",
+            (user_id, time.time())
+        )
+        if self._users is not None:
+            self._users.add(user_id)
+
     def remove_user(self, user_id: int):
         """Remove authorized user"""
-        with open(self.users_file, 'r') as f:
-            data = json.load(f)
-        
-        if 'authorized_users' in data and user_id in data['authorized_users']:
-            data['authorized_users'].remove(user_id)
-        
-        with open(self.users_file, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        self.conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        if self._users is not None:
+            self._users.discard(user_id)
+
     def get_user_language(self, user_id: int) -> str:
         """Get user language preference"""
-        with open(self.settings_file, 'r') as f:
-            data = json.load(f)
-            return data.get(str(user_id), {}).get('language', 'en')
-    
+        self._check_cache()
+        if self._languages is None:
+            rows = self.conn.execute("SELECT user_id, language FROM settings").fetchall()
+            self._languages = {row['user_id']: row['language'] for row in rows}
+        return self._languages.get(user_id, 'en')
+
     def set_user_language(self, user_id: int, language: str):
         """Set user language preference"""
-        with open(self.settings_file, 'r') as f:
-            data = json.load(f)
-        
-        if str(user_id) not in data:
-            data[str(user_id)] = {}
-        
-        data[str(user_id)]['language'] = language
-        
-        with open(self.settings_file, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        self.conn.execute(
+            "INSERT INTO settings (user_id, language) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET language = excluded.language",
+            (user_id, language)
+        )
+        if self._languages is not None:
+            self._languages[user_id] = language
+
+    def get_config(self, key: str) -> Optional[str]:
+        """Get a bot-wide setting shared by the bot and worker processes"""
+        row = self.conn.execute("SELECT value FROM config WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_config(self, key: str, value: str):
+        """Store a bot-wide setting"""
+        self.conn.execute(
+            "INSERT INTO config (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def _insert_queue_item(self, conn: sqlite3.Connection, item: Dict[str, Any]) -> str:
+        """Insert a queue item, assigning it a stable id"""
+        item_id = item.get('id') or uuid.uuid4().hex
+        data = {k: v for k, v in item.items() if k not in ('id', 'status', 'attempts', 'created_at', 'available_at')}
+        conn.execute(
+            "INSERT OR IGNORE INTO queue (id, user_id, data, created_at) VALUES (?, ?, ?, ?)",
+            (item_id, item['user_id'], json.dumps(data), time.time())
+        )
+        return item_id
+
+    def _row_to_item(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """Turn a queue row back into the item dict handlers work with"""
+        item = json.loads(row['data'])
+        item['id'] = row['id']
+        item['status'] = row['status']
+        item['attempts'] = row['attempts']
+        item['created_at'] = row['created_at']
+        item['available_at'] = row['available_at']
+        return item
+
     def get_queue(self) -> List[Dict[str, Any]]:
         """Get processing queue"""
-        with open(self.queue_file, 'r') as f:
-            data = json.load(f)
-            return data.get('queue', [])
-    
-    def add_to_queue(self, item: Dict[str, Any]):
+        rows = self.conn.execute(
+            "SELECT id, status, attempts, created_at, available_at, data FROM queue WHERE status != 'failed' ORDER BY seq"
+        ).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
+    def queue_counts(self) -> Dict[str, int]:
+        """Count queue items by status"""
+        rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM queue GROUP BY status")
+        return {row['status']: row['n'] for row in rows}
+
+    def queue_tail(self, offset: int, limit: int, per_user: int, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get a slice of the pending items outside the ready_items window
+
+        Ready items beyond each user's window come first in arrival order,
+        then items still waiting out a retry delay, soonest first.
+        """
+        now = time.time()
+        scope = " AND user_id = ?" if user_id is not None else ""
+        rows = self.conn.execute(
+            "SELECT id, status, attempts, created_at, available_at, data FROM ("
+            "SELECT *, available_at <= ? AS ready, "
+            "ROW_NUMBER() OVER (PARTITION BY user_id, available_at <= ? ORDER BY seq) AS rn FROM queue "
+            f"WHERE status = 'pending'{scope}"
+            ") WHERE NOT ready OR rn > ? "
+            "ORDER BY ready DESC, CASE WHEN ready THEN seq ELSE available_at END LIMIT ? OFFSET ?",
+            (now, now) + ((user_id,) if user_id is not None else ()) + (per_user, limit, offset)
+        ).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
+    def ready_items(self, per_user: int, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get each user's per_user oldest pending items that can be claimed now
+
+        Windowing per user keeps the set the scheduler sorts small without
+        hiding a user whose items all arrived behind someone's backlog.
+        """
+        scope = " AND user_id = ?" if user_id is not None else ""
+        rows = self.conn.execute(
+            "SELECT id, status, attempts, created_at, available_at, data FROM ("
+            "SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY seq) AS rn FROM queue "
+            f"WHERE status = 'pending' AND available_at <= ?{scope}"
+            ") WHERE rn <= ? ORDER BY seq",
+            (time.time(),) + ((user_id,) if user_id is not None else ()) + (per_user,)
+        ).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
+    def queue_summary(self, user_id: Optional[int] = None) -> Dict[str, int]:
+        """Count the unfinished items and their known total size"""
+        scope = " AND user_id = ?" if user_id is not None else ""
+        row = self.conn.execute(
+            "SELECT COUNT(*) AS items, "
+            "COALESCE(SUM(json_extract(data, '$.file_size')), 0) AS bytes, "
+            "COALESCE(SUM(COALESCE(json_extract(data, '$.file_size'), 0) = 0), 0) AS unknown "
+            f"FROM queue WHERE status IN ('pending', 'active'){scope}",
+            (user_id,) if user_id is not None else ()
+        ).fetchone()
+        return {'items': row['items'], 'bytes': row['bytes'], 'unknown': row['unknown']}
+
+    def get_queue_item(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Get a single queue item by id"""
+        row = self.conn.execute(
+            "SELECT id, status, attempts, created_at, available_at, data FROM queue WHERE id = ?", (item_id,)
+        ).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def add_to_queue(self, item: Dict[str, Any]) -> str:
         """Add item to processing queue"""
-        with open(self.queue_file, 'r') as f:
-            data = json.load(f)
-        
-        if 'queue' not in data:
-            data['queue'] = []
-        
-        data['queue'].append(item)
-        
-        with open(self.queue_file, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        with self.transaction() as conn:
+            return self._insert_queue_item(conn, item)
+
+    def claim_queue_item(
+        self,
+        item_id: Optional[str] = None,
+        worker: Optional[str] = None,
+        lease: float = 0
+    ) -> Optional[Dict[str, Any]]:
+        """Mark a pending item as active and return it, the oldest one unless item_id is given
+
+        The claiming worker holds the item for lease seconds and has to
+        renew the lease before then, or the item goes back to the queue.
+        """
+        with self.transaction() as conn:
+            if item_id is None:
+                row = conn.execute(
+                    "SELECT id, status, attempts, created_at, available_at, data FROM queue "
+                    "WHERE status = 'pending' AND available_at <= ? ORDER BY seq LIMIT 1",
+                    (time.time(),)
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT id, status, attempts, created_at, available_at, data FROM queue "
+                    "WHERE id = ? AND status = 'pending' AND available_at <= ?",
+                    (item_id, time.time())
+                ).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE queue SET status = 'active', worker = ?, lease_until = ? WHERE id = ?",
+                (worker, time.time() + lease if lease else None, row['id'])
+            )
+
+        item = self._row_to_item(row)
+        item['status'] = 'active'
+        return item
+
+    def next_retry_delay(self) -> Optional[float]:
+        """Get the seconds until the next delayed pending item becomes available"""
+        row = self.conn.execute(
+            "SELECT MIN(available_at) AS available_at FROM queue WHERE status = 'pending'"
+        ).fetchone()
+        if row['available_at'] is None:
+            return None
+        return max(0.0, row['available_at'] - time.time())
+
+    def defer_queue_item(self, item_id: str, delay: float):
+        """Put an item back in the queue for later without counting an attempt"""
+        self.conn.execute(
+            "UPDATE queue SET status = 'pending', available_at = ?, worker = NULL, lease_until = NULL "
+            "WHERE id = ?",
+            (time.time() + delay, item_id)
+        )
+
+    def requeue_active_items(self, worker: Optional[str] = None):
+        """Return items left active by a previous run of worker to the pending state"""
+        self.conn.execute(
+            "UPDATE queue SET status = 'pending', worker = NULL, lease_until = NULL "
+            "WHERE status = 'active' AND (worker IS NULL OR worker = ?)",
+            (worker,)
+        )
+
+    def renew_leases(self, worker: str, item_ids: List[str], lease: float) -> List[str]:
+        """Extend the leases worker holds on item_ids and return the ids it no longer holds"""
+        if not item_ids:
+            return []
+
+        placeholders = ",".join("?" * len(item_ids))
+        with self.transaction() as conn:
+            conn.execute(
+                f"UPDATE queue SET lease_until = ? "
+                f"WHERE worker = ? AND status = 'active' AND id IN ({placeholders})",
+                (time.time() + lease, worker, *item_ids)
+            )
+            held = {
+                row['id'] for row in conn.execute(
+                    f"SELECT id FROM queue WHERE worker = ? AND status = 'active' AND id IN ({placeholders})",
+                    (worker, *item_ids)
+                )
+            }
+        return [item_id for item_id in item_ids if item_id not in held]
+
+    def reclaim_expired_leases(self) -> int:
+        """Return items whose worker stopped renewing its lease to the queue"""
+        return self.conn.execute(
+            "UPDATE queue SET status = 'pending', worker = NULL, lease_until = NULL "
+            "WHERE status = 'active' AND lease_until IS NOT NULL AND lease_until < ?",
+            (time.time(),)
+        ).rowcount
+
+    def active_items(self) -> List[Dict[str, Any]]:
+        """Get the items currently claimed, with the worker holding each one"""
+        rows = self.conn.execute(
+            "SELECT id, status, attempts, created_at, available_at, data, worker, lease_until "
+            "FROM queue WHERE status = 'active' ORDER BY seq"
+        ).fetchall()
+        items = []
+        for row in rows:
+            item = self._row_to_item(row)
+            item['worker'] = row['worker']
+            item['lease_until'] = row['lease_until']
+            items.append(item)
+        return items
+
+    def retry_queue_item(self, item_id: str, error: str, delay: float):
+        """Put a failed item back in the queue once delay seconds have passed"""
+        self.conn.execute(
+            "UPDATE queue SET status = 'pending', attempts = attempts + 1, "
+            "available_at = ?, error = ?, worker = NULL, lease_until = NULL WHERE id = ?",
+            (time.time() + delay, error, item_id)
+        )
+
+    def fail_queue_item(self, item_id: str, error: str):
+        """Mark an item as permanently failed"""
+        self.conn.execute(
+            "UPDATE queue SET status = 'failed', attempts = attempts + 1, error = ?, "
+            "worker = NULL, lease_until = NULL WHERE id = ?",
+            (error, item_id)
+        )
+
     def remove_from_queue(self, index: int):
         """Remove item from queue"""
-        with open(self.queue_file, 'r') as f:
-            data = json.load(f)
-        
-        if 'queue' in data and len(data['queue']) > index:
-            del data['queue'][index]
-        
-        with open(self.queue_file, 'w') as f:
-            json.dump(data, f, indent=2)
-    
+        self.conn.execute(
+            "DELETE FROM queue WHERE seq = ("
+            "SELECT seq FROM queue WHERE status != 'failed' ORDER BY seq LIMIT 1 OFFSET ?)",
+            (index,)
+        )
+
+    def remove_queue_item(self, item_id: str):
+        """Remove item from queue by id"""
+        self.conn.execute("DELETE FROM queue WHERE id = ?", (item_id,))
+
+    def remove_user_items(self, user_id: int) -> List[str]:
+        """Remove every queue item of a user and return their ids"""
+        with self.transaction() as conn:
+            ids = [row['id'] for row in conn.execute("SELECT id FROM queue WHERE user_id = ?", (user_id,))]
+            conn.execute("DELETE FROM queue WHERE user_id = ?", (user_id,))
+        return ids
+
     def clear_queue(self):
         """Clear the entire queue"""
-        with open(self.queue_file, 'w') as f:
-            json.dump({'queue': []}, f, indent=2)
+        self.conn.execute("DELETE FROM queue")
+
+    def get_transfer(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Get the saved partial transfer state of a queue item"""
+        row = self.conn.execute(
+            "SELECT state FROM transfers WHERE item_id = ?", (item_id,)
+        ).fetchone()
+        return json.loads(row['state']) if row else None
+
+    def save_transfer(self, item_id: str, state: Dict[str, Any]):
+        """Persist the partial transfer state of a queue item"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO transfers (item_id, state, updated_at) VALUES (?, ?, ?)",
+            (item_id, json.dumps(state), time.time())
+        )
+
+    def transfer_paths(self) -> List[str]:
+        """Get the temp file paths of transfers whose queue item still exists"""
+        rows = self.conn.execute(
+            "SELECT transfers.state FROM transfers JOIN queue ON queue.id = transfers.item_id"
+        )
+        return [path for path in (json.loads(row['state']).get('path') for row in rows) if path]
+
+    def delete_transfer(self, item_id: str):
+        """Forget the transfer state of a queue item"""
+        self.conn.execute("DELETE FROM transfers WHERE item_id = ?", (item_id,))
+
+    def create_broadcast(self, broadcast_id: str, chat_id: int, text: str, user_ids: List[int]) -> int:
+        """Persist a broadcast job, skipping users known to have blocked the bot"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO broadcasts (id, chat_id, text, created_at) VALUES (?, ?, ?, ?)",
+                (broadcast_id, chat_id, text, time.time())
+            )
+            blocked = {row['user_id'] for row in conn.execute("SELECT user_id FROM blocked_users")}
+            recipients = [(broadcast_id, user_id) for user_id in user_ids if user_id not in blocked]
+            conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)",
+                recipients
+            )
+        return len(recipients)
+
+    def get_broadcast(self, broadcast_id: str) -> Optional[Dict[str, Any]]:
+        """Get a broadcast job"""
+        row = self.conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_broadcasts(self, status: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get the most recent broadcast jobs, optionally only those with a status"""
+        if status:
+            rows = self.conn.execute(
+                "SELECT * FROM broadcasts WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                (status, limit)
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT * FROM broadcasts ORDER BY created_at DESC LIMIT ?", (limit,)
+            )
+        return [dict(row) for row in rows]
+
+    def set_broadcast_status(self, broadcast_id: str, status: str):
+        """Update the status of a broadcast job"""
+        finished_at = time.time() if status in ('completed', 'cancelled') else None
+        self.conn.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+            (status, finished_at, broadcast_id)
+        )
+
+    def pending_recipients(self, broadcast_id: str) -> List[int]:
+        """Get the recipients a broadcast has not reached yet"""
+        rows = self.conn.execute(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'",
+            (broadcast_id,)
+        )
+        return [row['user_id'] for row in rows]
+
+    def record_delivery(self, broadcast_id: str, user_id: int, status: str, error: Optional[str] = None):
+        """Record the outcome of sending a broadcast to one recipient"""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE broadcast_recipients SET status = ?, error = ? "
+                "WHERE broadcast_id = ? AND user_id = ?",
+                (status, error, broadcast_id, user_id)
+            )
+            if status in ('blocked', 'deactivated'):
+                conn.execute(
+                    "INSERT OR REPLACE INTO blocked_users (user_id, reason, blocked_at) VALUES (?, ?, ?)",
+                    (user_id, status, time.time())
+                )
+
+    def broadcast_stats(self, broadcast_id: str) -> Dict[str, int]:
+        """Count the recipients of a broadcast by delivery status"""
+        stats = {'pending': 0, 'sent': 0, 'failed': 0, 'blocked': 0, 'deactivated': 0}
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) AS count FROM broadcast_recipients "
+            "WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        )
+        for row in rows:
+            stats[row['status']] = row['count']
+        return stats
+
+    def unblock_user(self, user_id: int):
+        """Include a user in broadcasts again"""
+        self.conn.execute("DELETE FROM blocked_users WHERE user_id = ?", (user_id,))
+
+    def get_dedup(self, keys: List[str], min_created: float) -> Optional[str]:
+        """Get the Hydrax slug stored under any of the keys, if it is recent enough"""
+        if not keys:
+            return None
+
+        placeholders = ", ".join("?" for _ in keys)
+        row = self.conn.execute(
+            f"SELECT key, slug FROM dedup WHERE key IN ({placeholders}) AND created_at >= ? LIMIT 1",
+            (*keys, min_created)
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.conn.execute("UPDATE dedup SET last_used = ? WHERE key = ?", (time.time(), row['key']))
+        return row['slug']
+
+    def put_dedup(self, keys: List[str], slug: str, size: int = 0):
+        """Store a Hydrax slug under each of the keys"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO dedup (key, slug, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(key, slug, size, now, now) for key in keys]
+            )
+
+    def prune_dedup(self, min_created: float, max_entries: int) -> int:
+        """Drop expired entries and the least recently used ones beyond max_entries"""
+        with self.transaction() as conn:
+            removed = conn.execute("DELETE FROM dedup WHERE created_at < ?", (min_created,)).rowcount
+            removed += conn.execute(
+                "DELETE FROM dedup WHERE key IN ("
+                "SELECT key FROM dedup ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (max_entries,)
+            ).rowcount
+        return removed
+
+    def clear_dedup(self) -> int:
+        """Drop every dedup entry"""
+        return self.conn.execute("DELETE FROM dedup").rowcount
 
 db = Database()
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import time
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from utils.database import db
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so trivially different spellings map to the same key"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+
+    netloc = host
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        netloc = f"{host}:{parts.port}"
+
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Get the SHA-256 of a file, meant to run in an executor"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DedupIndex:
+    """Remember which Hydrax slug earlier uploads produced, so repeats skip the transfer"""
+
+    def __init__(self):
+        self.ttl = float(os.getenv('DEDUP_TTL_DAYS') or 30) * 86400
+        self.max_entries = int(os.getenv('DEDUP_MAX_ENTRIES') or 10000)
+
+    @staticmethod
+    def telegram_key(file_unique_id: str) -> str:
+        """Key for a Telegram file, stable across forwards and re-sends"""
+        return f"tg:{file_unique_id}"
+
+    @staticmethod
+    def url_key(url: str, etag: str = '', last_modified: str = '', size: int = 0) -> Optional[str]:
+        """Key for a URL, only trusted when the server gave us a validator
+
+        The size alone can't tell a replaced file from the one uploaded
+        before, so without an ETag or Last-Modified there is no key.
+        """
+        if etag:
+            return f"url:{normalize_url(url)}|{etag}"
+        if last_modified:
+            return f"url:{normalize_url(url)}|{last_modified}|{size}"
+        return None
+
+    @staticmethod
+    def content_key(sha256: str) -> str:
+        """Key for the downloaded bytes themselves"""
+        return f"sha256:{sha256}"
+
+    def lookup(self, keys: List[Optional[str]]) -> Optional[str]:
+        """Get the slug of an earlier upload matching any of the keys"""
+        return db.get_dedup([key for key in keys if key], time.time() - self.ttl)
+
+    def remember(self, keys: List[Optional[str]], slug: str, size: int = 0):
+        """Record the slug an upload produced under each key"""
+        keys = [key for key in keys if key]
+        if not keys or not slug:
+            return
+        db.put_dedup(keys, slug, size)
+        db.prune_dedup(time.time() - self.ttl, self.max_entries)
+
+    def purge(self, expired_only: bool = False) -> int:
+        """Drop expired entries, or everything, and return how many were removed"""
+        if expired_only:
+            return db.prune_dedup(time.time() - self.ttl, self.max_entries)
+        return db.clear_dedup()
+
+dedup = DedupIndex()
@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+from utils.logger import logger
+from utils.metrics import metrics
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLER_PATHS = (os.path.join(PROJECT_ROOT, 'bot.py'), os.path.join(PROJECT_ROOT, 'handlers') + os.sep)
+
+class LoopMonitor:
+    """Opt-in watchdog for code that blocks the event loop
+
+    A task on the loop beats every interval and records how late it woke
+    up. A separate thread samples the loop thread's stack: samples taken
+    while the loop is busy are charged to the handler on the stack, and
+    when the beat is overdue by more than the threshold the stack of
+    whatever is holding the loop is kept for the report.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+        self.interval = float(os.getenv('DIAG_LAG_INTERVAL') or 0.1)
+        self.threshold = float(os.getenv('DIAG_BLOCK_THRESHOLD') or 0.1)
+        self.sample_interval = float(os.getenv('DIAG_SAMPLE_INTERVAL') or 0.01)
+        self.max_stalls = int(os.getenv('DIAG_MAX_STALLS') or 20)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._stall: Optional[Dict] = None
+        self.reset()
+
+    def reset(self):
+        """Forget the collected stalls and handler times"""
+        with self._lock:
+            self.started = time.monotonic()
+            self.busy_time: Dict[str, float] = {}
+            self.stalls: Dict[Tuple, Dict] = {}
+            self.max_lag = 0.0
+
+    def start(self):
+        """Start monitoring the running loop, if diagnostics are enabled"""
+        if not self.enabled or self._task:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self._thread.start()
+        logger.info(f"Loop diagnostics enabled (threshold {self.threshold * 1000:.0f}ms)")
+
+    async def stop(self):
+        """Stop the heartbeat and the sampling thread"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self):
+        """Measure how late the loop wakes a sleeping task"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._last_beat = now
+            metrics.observe('hydrax_loop_lag_seconds', lag)
+            with self._lock:
+                self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        """Sample the loop thread's stack until stopped"""
+        while not self._stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            now = time.monotonic()
+            overdue = now - self._last_beat - self.interval
+            idle = self._is_idle(frame)
+
+            with self._lock:
+                if not idle:
+                    owner = self._owner(frame)
+                    self.busy_time[owner] = self.busy_time.get(owner, 0.0) + self.sample_interval
+
+                if overdue >= self.threshold and not idle:
+                    if self._stall is None or self._stall['beat'] != self._last_beat:
+                        self._stall = self._record_stall(frame)
+                    self._stall['entry']['max'] = max(self._stall['entry']['max'], overdue)
+                elif self._stall is not None and self._stall['beat'] != self._last_beat:
+                    self._stall = None
+
+    def _record_stall(self, frame) -> Dict:
+        """Remember the stack holding the loop, grouped with earlier stalls at the same spot"""
+        stack = traceback.extract_stack(frame)
+        key = tuple((entry.filename, entry.lineno) for entry in stack[-8:])
+
+        entry = self.stalls.get(key)
+        if entry is None:
+            if len(self.stalls) >= self.max_stalls:
+                # Make room by dropping the stall seen least often
+                del self.stalls[min(self.stalls, key=lambda k: self.stalls[k]['count'])]
+            entry = self.stalls[key] = {
+                'count': 0,
+                'max': 0.0,
+                'owner': self._owner(frame),
+                'stack': ''.join(traceback.format_list(stack[-8:]))
+            }
+
+        entry['count'] += 1
+        entry['last'] = time.time()
+        # Metrics belong to the loop thread, count the stall once it is free again
+        self._loop.call_soon_threadsafe(
+            functools.partial(metrics.inc, 'hydrax_loop_stalls_total', owner=entry['owner'])
+        )
+        logger.warning(f"Event loop blocked for over {self.threshold * 1000:.0f}ms in {entry['owner']}")
+        return {'beat': self._last_beat, 'entry': entry}
+
+    @staticmethod
+    def _is_idle(frame) -> bool:
+        """Check whether the loop thread is waiting in the selector"""
+        return frame.f_code.co_name in ('select', 'poll') and frame.f_code.co_filename.endswith('selectors.py')
+
+    @staticmethod
+    def _owner(frame) -> str:
+        """Name the handler on the stack, or the innermost project function"""
+        project = None
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(HANDLER_PATHS):
+                return f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_code.co_name}"
+            if project is None and filename.startswith(PROJECT_ROOT):
+                project = f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_code.co_name}"
+            frame = frame.f_back
+        return project or "other"
+
+    def report(self, top: int = 10) -> str:
+        """Describe loop lag, the worst stalls and where busy time went"""
+        if not self.enabled:
+            return "🩺 Diagnostics are off, set DIAGNOSTICS=true to enable them"
+
+        count, lags = metrics.percentiles('hydrax_loop_lag_seconds', 300, (50, 99))
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            busy = sorted(self.busy_time.items(), key=lambda item: item[1], reverse=True)
+            stalls = sorted(self.stalls.values(), key=lambda entry: entry['max'], reverse=True)
+            max_lag = self.max_lag
+
+        lines = [f"🩺 Event loop diagnostics ({elapsed:.0f}s)", ""]
+        if count:
+            lines.append(
+                f"Lag (5m): p50 {lags[0] * 1000:.1f}ms, p99 {lags[1] * 1000:.1f}ms, "
+                f"max since reset {max_lag * 1000:.1f}ms"
+            )
+
+        lines.append("")
+        lines.append(f"Busy time by handler ({sum(t for _, t in busy) / max(elapsed, 1e-9) * 100:.1f}% of the loop):")
+        for owner, seconds in busy[:top]:
+            lines.append(f"  {seconds:8.2f}s  {owner}")
+        if not busy:
+            lines.append("  none")
+
+        lines.append("")
+        lines.append(f"Stalls over {self.threshold * 1000:.0f}ms:")
+        for entry in stalls[:top]:
+            lines.append(f"  {entry['count']}x, worst {entry['max'] * 1000:.0f}ms in {entry['owner']}")
+            lines.append(entry['stack'].rstrip())
+        if not stalls:
+            lines.append("  none")
+
+        return "\n".join(lines)
+
+loop_monitor = LoopMonitor()
+
+metrics.histogram('hydrax_loop_lag_seconds', "How late the event loop woke a sleeping task", (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5
+))
+metrics.counter('hydrax_loop_stalls_total', "Times the event loop was blocked past the threshold, by handler")
@@ -0,0 +1,425 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import aiohttp
+from pyrogram.errors import FloodWait
+from utils.http_client import HttpClient, http_client
+from utils.logger import logger
+
+# userbot.stream_media offsets are counted in chunks of this size
+TELEGRAM_CHUNK_SIZE = 1024 * 1024
+
+class Checkpointer:
+    """Persist transfer state at most once per interval"""
+
+    def __init__(self, state: Dict[str, Any], on_checkpoint: Optional[Callable[[Dict[str, Any]], None]]):
+        self.state = state
+        self.on_checkpoint = on_checkpoint
+        self.interval = float(os.getenv('CHECKPOINT_INTERVAL') or 2)
+        self._saved_at = time.monotonic()
+
+    def save(self, force: bool = False):
+        """Save the state if the interval has passed, or right away when forced"""
+        if not self.on_checkpoint:
+            return
+
+        now = time.monotonic()
+        if force or now - self._saved_at >= self.interval:
+            self._saved_at = now
+            self.on_checkpoint(self.state)
+
+class SegmentedDownloader:
+    """Download a URL over several parallel Range requests when the server allows it
+
+    Progress is kept in a state dict (size, validators and per-segment
+    offsets) so an interrupted download can continue where it stopped.
+    """
+
+    def __init__(self, http: Optional[HttpClient] = None, connections: Optional[int] = None):
+        self.http = http or http_client
+        self.connections = connections or int(os.getenv('DOWNLOAD_CONNECTIONS') or 4)
+        self.min_segment_size = int(os.getenv('DOWNLOAD_MIN_SEGMENT') or 8 * 1024 * 1024)
+        self.chunk_size = 256 * 1024
+        self.write_size = 1024 * 1024
+
+    async def probe(
+        self,
+        url: str,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+        retry: bool = True
+    ) -> Tuple[int, bool, Dict[str, str]]:
+        """Get the size of a URL, whether it supports range requests and its validators"""
+        kwargs = {'timeout': timeout} if timeout else {}
+        async with self.http.get(url, retry=retry, headers={'Range': 'bytes=0-0'}, **kwargs) as response:
+            validators = {
+                'etag': response.headers.get('ETag', ''),
+                'last_modified': response.headers.get('Last-Modified', '')
+            }
+
+            if response.status == 206:
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if total.isdigit():
+                    return int(total), True, validators
+                return 0, False, validators
+
+            if response.status == 200:
+                # The server ignored our Range header, whatever Accept-Ranges claims
+                return int(response.headers.get('Content-Length', 0)), False, validators
+
+            raise Exception(f"HTTP {response.status}")
+
+    def _can_resume(self, state: Dict[str, Any], file_path: str, total: int, validators: Dict[str, str]) -> bool:
+        """Check that saved state still describes the same remote file"""
+        if not state.get('segments') or state.get('size') != total:
+            return False
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != total:
+            return False
+        if state.get('etag'):
+            return state['etag'] == validators['etag']
+        return state.get('last_modified', '') == validators['last_modified']
+
+    async def download(
+        self,
+        url: str,
+        file_path: str,
+        progress: Optional[Callable] = None,
+        on_segments: Optional[Callable[[List[Tuple[int, int]]], None]] = None,
+        state: Optional[Dict[str, Any]] = None,
+        on_checkpoint: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> int:
+        """Download url into file_path and return the number of bytes written"""
+        state = state if state is not None else {}
+        checkpointer = Checkpointer(state, on_checkpoint)
+        total, ranged, validators = await self.probe(url)
+
+        if not ranged:
+            # Nothing to resume from without range support
+            state.pop('segments', None)
+            checkpointer.save(force=True)
+            return await self._download_single(url, file_path, progress, state)
+
+        loop = asyncio.get_running_loop()
+        state.pop('sha256', None)
+
+        if not self._can_resume(state, file_path, total, validators):
+            count = max(1, min(self.connections, total // self.min_segment_size))
+            size = total // count
+            state.update(validators)
+            state['size'] = total
+            state['segments'] = [
+                [i * size, total - 1 if i == count - 1 else (i + 1) * size - 1, 0]
+                for i in range(count)
+            ]
+            await loop.run_in_executor(None, self._preallocate, file_path, total)
+            checkpointer.save(force=True)
+
+        segments = state['segments']
+
+        async def report():
+            checkpointer.save()
+            if on_segments:
+                on_segments([(done, end - start + 1) for start, end, done in segments])
+            if progress:
+                await progress(sum(done for _, _, done in segments), total)
+
+        fd = os.open(file_path, os.O_WRONLY)
+        tasks = [
+            asyncio.create_task(self._download_segment(url, fd, index, segment, report))
+            for index, segment in enumerate(segments)
+        ]
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            os.close(fd)
+            checkpointer.save(force=True)
+
+        return total
+
+    async def _download_segment(self, url: str, fd: int, index: int, segment: List[int], report):
+        """Fetch the rest of one byte range and write it at its offset"""
+        start, end, done = segment
+        length = end - start + 1
+        if done >= length:
+            return
+
+        async def written(n: int):
+            segment[2] = done + n
+            await report()
+
+        headers = {'Range': f"bytes={start + done}-{end}"}
+        async with self.http.get(url, headers=headers) as response:
+            if response.status != 206:
+                raise Exception(f"Range request failed: HTTP {response.status}")
+
+            await self._write_response(response, fd, start + done, written)
+
+        if segment[2] != length:
+            raise Exception(f"Segment {index} ended early ({segment[2]}/{length} bytes)")
+
+    async def _download_single(
+        self,
+        url: str,
+        file_path: str,
+        progress: Optional[Callable],
+        state: Dict[str, Any]
+    ) -> int:
+        """Fetch the whole body over a single connection, hashing it on the way"""
+        async with self.http.get(url) as response:
+            if response.status != 200:
+                raise Exception(f"HTTP {response.status}")
+
+            total = int(response.headers.get('Content-Length', 0))
+
+            async def report(written: int):
+                if progress:
+                    await progress(written, total)
+
+            digest = hashlib.sha256()
+            fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                written = await self._write_response(response, fd, 0, report, digest)
+            finally:
+                os.close(fd)
+
+        state['sha256'] = digest.hexdigest()
+        return written
+
+    async def _write_response(self, response, fd: int, offset: int, report, digest=None) -> int:
+        """Copy a response body to fd at offset, writing off the event loop"""
+        loop = asyncio.get_running_loop()
+        buffer = bytearray()
+        written = 0
+
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            if digest is not None:
+                digest.update(chunk)
+            buffer += chunk
+            if len(buffer) >= self.write_size:
+                data = bytes(buffer)
+                buffer.clear()
+                await loop.run_in_executor(None, os.pwrite, fd, data, offset + written)
+                written += len(data)
+                await report(written)
+
+        if buffer:
+            await loop.run_in_executor(None, os.pwrite, fd, bytes(buffer), offset + written)
+            written += len(buffer)
+            await report(written)
+
+        return written
+
+    @staticmethod
+    def _preallocate(file_path: str, size: int):
+        """Reserve the full file size up front"""
+        with open(file_path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+
+class TelegramDownloader:
+    """Download Telegram media through stream_media, resuming from the last saved offset
+
+    Files of known size are fetched as several stripes of parts at once,
+    each written at its own offset of a preallocated file. If that fails
+    for any reason other than FloodWait, download_media gets a go instead.
+    """
+
+    def __init__(self, client, parallel: Optional[int] = None):
+        self.client = client
+        self.parallel = parallel or int(os.getenv('TELEGRAM_DOWNLOAD_PARTS') or 4)
+        self.min_stripe = int(os.getenv('TELEGRAM_MIN_STRIPE') or 8)
+
+    async def download(
+        self,
+        file_id: str,
+        file_path: str,
+        file_size: int = 0,
+        progress: Optional[Callable] = None,
+        state: Optional[Dict[str, Any]] = None,
+        on_checkpoint: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> int:
+        """Download file_id into file_path and return the number of bytes written"""
+        state = state if state is not None else {}
+
+        # Stripes beyond the client's transmission limit would only queue behind the others
+        parallel = min(self.parallel, getattr(self.client, 'max_concurrent_transmissions', self.parallel))
+
+        # A download that was started on the sequential path resumes there
+        if not file_size or parallel < 2 or (state.get('written') and not state.get('parts')):
+            return await self._download_sequential(file_id, file_path, file_size, progress, state, on_checkpoint)
+
+        try:
+            return await self._download_parallel(file_id, file_path, file_size, parallel, progress, state, on_checkpoint)
+        except FloodWait:
+            raise
+        except Exception as e:
+            logger.warning(f"Parallel download of {file_id} failed, falling back to download_media: {e}")
+            return await self._download_fallback(file_id, file_path, file_size, progress, state, on_checkpoint)
+
+    async def _download_parallel(
+        self,
+        file_id: str,
+        file_path: str,
+        file_size: int,
+        parallel: int,
+        progress: Optional[Callable],
+        state: Dict[str, Any],
+        on_checkpoint: Optional[Callable[[Dict[str, Any]], None]]
+    ) -> int:
+        """Fetch stripes of parts concurrently into a preallocated file
+
+        Every stripe is one stream_media call, and pyrogram opens a media
+        session (exporting the authorization for other DCs) per call, so
+        the file is cut into at most parallel long stripes rather than
+        many short ones.
+        """
+        checkpointer = Checkpointer(state, on_checkpoint)
+        loop = asyncio.get_running_loop()
+        state.pop('sha256', None)
+
+        chunks = -(-file_size // TELEGRAM_CHUNK_SIZE)
+        resumable = (
+            state.get('parts') and state.get('size') == file_size and
+            os.path.exists(file_path) and os.path.getsize(file_path) == file_size
+        )
+        if not resumable:
+            count = max(1, min(parallel, chunks // self.min_stripe))
+            stripe = chunks // count
+            # Each part is [first chunk, end chunk, chunks done]
+            state['parts'] = [
+                [i * stripe, chunks if i == count - 1 else (i + 1) * stripe, 0]
+                for i in range(count)
+            ]
+            state['size'] = file_size
+            state.pop('written', None)
+            await loop.run_in_executor(None, SegmentedDownloader._preallocate, file_path, file_size)
+            checkpointer.save(force=True)
+
+        parts = state['parts']
+
+        def done_bytes() -> int:
+            total = 0
+            for start, end, done in parts:
+                total += min(done * TELEGRAM_CHUNK_SIZE, file_size - start * TELEGRAM_CHUNK_SIZE)
+            return total
+
+        async def fetch(part: List[int]):
+            start, end, done = part
+            if start + done >= end:
+                return
+
+            offset = start + done
+            async for chunk in self.client.stream_media(file_id, limit=end - offset, offset=offset):
+                await loop.run_in_executor(None, os.pwrite, fd, chunk, offset * TELEGRAM_CHUNK_SIZE)
+                offset += 1
+                part[2] = offset - start
+                checkpointer.save()
+                if progress:
+                    await progress(done_bytes(), file_size)
+
+            if offset != end:
+                raise Exception(f"Part {start}-{end} ended early at chunk {offset}")
+
+        fd = os.open(file_path, os.O_WRONLY)
+        tasks = [asyncio.create_task(fetch(part)) for part in parts]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            os.close(fd)
+            checkpointer.save(force=True)
+
+        return file_size
+
+    async def _download_fallback(
+        self,
+        file_id: str,
+        file_path: str,
+        file_size: int,
+        progress: Optional[Callable],
+        state: Dict[str, Any],
+        on_checkpoint: Optional[Callable[[Dict[str, Any]], None]]
+    ) -> int:
+        """Let pyrogram download the whole file in one go"""
+        # Leave no resume offset behind, a retry starts over with the parallel path
+        state.pop('parts', None)
+        state.pop('sha256', None)
+        state.pop('written', None)
+        if on_checkpoint:
+            on_checkpoint(state)
+
+        path = await self.client.download_media(file_id, file_name=file_path, progress=progress)
+        if not path:
+            raise Exception("download_media returned nothing")
+        if os.path.abspath(path) != os.path.abspath(file_path):
+            await asyncio.get_running_loop().run_in_executor(None, shutil.move, path, file_path)
+
+        written = os.path.getsize(file_path)
+        if file_size and written != file_size:
+            raise Exception(f"Download ended early ({written}/{file_size} bytes)")
+        return written
+
+    async def _download_sequential(
+        self,
+        file_id: str,
+        file_path: str,
+        file_size: int,
+        progress: Optional[Callable],
+        state: Dict[str, Any],
+        on_checkpoint: Optional[Callable[[Dict[str, Any]], None]]
+    ) -> int:
+        """Stream the file in order, hashing it when starting from scratch"""
+        checkpointer = Checkpointer(state, on_checkpoint)
+        loop = asyncio.get_running_loop()
+
+        # Only whole chunks can be resumed, drop anything past the last one
+        written = state.get('written', 0) if os.path.exists(file_path) else 0
+        written -= written % TELEGRAM_CHUNK_SIZE
+
+        # The content hash can only be built incrementally on a fresh download
+        digest = hashlib.sha256() if written == 0 else None
+        state.pop('sha256', None)
+
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, written)
+            if file_size and hasattr(os, 'posix_fallocate'):
+                # Reserve the rest of the file up front, parts are written at explicit offsets
+                await loop.run_in_executor(None, os.posix_fallocate, fd, 0, file_size)
+            state['written'] = written
+            checkpointer.save(force=True)
+
+            async for chunk in self.client.stream_media(file_id, offset=written // TELEGRAM_CHUNK_SIZE):
+                await loop.run_in_executor(None, os.pwrite, fd, chunk, written)
+                if digest is not None:
+                    digest.update(chunk)
+                written += len(chunk)
+                state['written'] = written
+                checkpointer.save()
+                if progress:
+                    await progress(written, file_size)
+
+            if digest is not None:
+                state['sha256'] = digest.hexdigest()
+        finally:
+            os.close(fd)
+            checkpointer.save(force=True)
+
+        if file_size and written != file_size:
+            raise Exception(f"Download ended early ({written}/{file_size} bytes)")
+
+        return written
@@ -1,7 +1,8 @@
 import asyncio
 import aiohttp
 import time
-from typing import List, Dict, Any
+from utils.http_client import http_client
+from typing import List, Dict, Any, Optional
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 def create_progress_bar(current: int, total: int, length: int = 20) -> str:
@@ -18,13 +19,24 @@ def format_bytes(bytes_value: int) -> str:
         bytes_value /= 1024.0
     return f"{bytes_value:.1f} TB"
 
+def format_duration(seconds: float) -> str:
+    """Format seconds as a short human readable duration"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    if seconds < 86400:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 86400}d {seconds % 86400 // 3600:02d}h"
+
 async def ping_host(host: str = "api.telegram.org") -> float:
     """Ping a host and return response time in ms"""
     start_time = time.time()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://{host}", timeout=5) as response:
-                await response.text()
+        timeout = aiohttp.ClientTimeout(total=5)
+        async with http_client.get(f"https://{host}", retry=False, timeout=timeout) as response:
+            await response.text()
         return round((time.time() - start_time) * 1000, 2)
     except:
         return -1
@@ -47,10 +59,18 @@ def get_confirmation_keyboard(yes_text: str = "✅ Yes", no_text: str = "🚫 No
         ]
     ])
 
-def get_next_queue_item(queue: List[Dict[str, Any]]) -> str:
-    """Get next item in queue"""
-    if len(queue) > 1:
-        next_item = queue[1]
+def get_next_queue_item(queue: List[Dict[str, Any]], active_ids: Optional[List[str]] = None) -> str:
+    """Get next item in queue that no worker has picked up yet
+
+    The queue is expected in scheduling order, see UploadHandler.scheduled_queue.
+    """
+    if active_ids is None:
+        pending = queue[1:]
+    else:
+        pending = [item for item in queue if item.get('id') not in active_ids]
+
+    if pending:
+        next_item = pending[0]
         if next_item.get('type') == 'telegram':
             return f"📱 {next_item.get('file_name', 'Unknown')}"
         else:
@@ -0,0 +1,91 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import aiohttp
+from utils.logger import logger
+
+# Responses worth another try for idempotent requests
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class HttpClient:
+    """Application-wide aiohttp session with a pooled, keep-alive connector
+
+    Started once in main() and closed at shutdown, so downloads, probes,
+    pings and Hydrax uploads reuse connections and cached DNS lookups
+    instead of paying for a fresh session on every request.
+    """
+
+    def __init__(self):
+        self.limit = int(os.getenv('HTTP_POOL_LIMIT') or 100)
+        self.limit_per_host = int(os.getenv('HTTP_LIMIT_PER_HOST') or 16)
+        self.dns_cache_ttl = int(os.getenv('HTTP_DNS_CACHE_TTL') or 300)
+        self.connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT') or 15)
+        self.read_timeout = float(os.getenv('HTTP_READ_TIMEOUT') or 60)
+        self.retries = int(os.getenv('HTTP_RETRIES') or 3)
+        self.retry_backoff = float(os.getenv('HTTP_RETRY_BACKOFF') or 0.5)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Create the shared session"""
+        if self._session and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            enable_cleanup_closed=True
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.connect_timeout,
+                sock_read=self.read_timeout
+            )
+        )
+
+    async def close(self):
+        """Close the shared session and its pooled connections"""
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP client is not started")
+        return self._session
+
+    @asynccontextmanager
+    async def get(self, url: str, retry: bool = True, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """GET a URL, retrying connection errors and transient statuses with backoff
+
+        Only getting the response is retried; errors while reading the
+        body are left to the caller.
+        """
+        attempts = self.retries + 1 if retry else 1
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                response = await self.session.get(url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last:
+                    raise
+                logger.warning(f"GET {url} failed ({e}), retrying")
+            else:
+                if response.status not in RETRY_STATUSES or last:
+                    break
+                response.release()
+                logger.warning(f"GET {url} returned HTTP {response.status}, retrying")
+
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+        try:
+            yield response
+        finally:
+            response.release()
+
+http_client = HttpClient()
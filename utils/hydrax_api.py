@@ -1,30 +1,122 @@
-import requests
+import asyncio
+import json
 import os
-from typing import Dict, Any
+import uuid
+import aiohttp
+from typing import Dict, Any, AsyncIterator, Callable, Optional
+from utils.database import db
+from utils.http_client import http_client
+from utils.metrics import metrics
 
 class HydraxAPI:
     def __init__(self):
         self.base_url = "http://up.hydrax.net"
         self.api_key = os.getenv('HYDRAX_API_ID')
-    
-    def upload_video(self, file_path: str, file_name: str) -> Dict[str, Any]:
-        """Upload video to Hydrax"""
-        if not self.api_key:
+        self.chunk_size = int(os.getenv('HYDRAX_CHUNK_SIZE') or 1024 * 1024)
+        self.connect_timeout = float(os.getenv('HYDRAX_CONNECT_TIMEOUT') or 30)
+        self.read_timeout = float(os.getenv('HYDRAX_READ_TIMEOUT') or 300)
+        self.total_timeout = float(os.getenv('HYDRAX_UPLOAD_TIMEOUT') or 0) or None
+
+    async def upload_video(
+        self,
+        file_path: str,
+        file_name: str,
+        progress: Optional[Callable] = None,
+        mime_type: str = 'video/mp4'
+    ) -> Dict[str, Any]:
+        """Upload video to Hydrax, streaming it from disk"""
+        file_size = os.path.getsize(file_path)
+        return await self.upload_stream(
+            self._read_file(file_path), file_name, file_size, progress=progress, mime_type=mime_type
+        )
+
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        file_name: str,
+        file_size: int,
+        progress: Optional[Callable] = None,
+        mime_type: str = 'video/mp4'
+    ) -> Dict[str, Any]:
+        """Upload a stream of exactly file_size bytes to Hydrax"""
+        api_key = self.current_api_key()
+        if not api_key:
             raise ValueError("HYDRAX_API_ID not configured")
-        
-        url = f"{self.base_url}/{self.api_key}"
-        
-        with open(file_path, 'rb') as f:
-            files = {'file': (file_name, f, 'video/mp4')}
-            response = requests.post(url, files=files)
-        
-        if response.status_code == 200:
-            return response.json()
+
+        url = f"{self.base_url}/{api_key}"
+
+        # Build the multipart envelope by hand so the body can be streamed
+        # with a known Content-Length instead of being assembled in memory
+        boundary = uuid.uuid4().hex
+        safe_name = file_name.replace('"', '%22').replace('\r', '').replace('\n', '')
+        head = (
+            f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"file\"; filename=\"{safe_name}\"\r\n"
+            f"Content-Type: {mime_type}\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+
+        async def body():
+            yield head
+            sent = 0
+            async for chunk in chunks:
+                sent += len(chunk)
+                if sent > file_size:
+                    raise Exception("Upload stream is larger than announced")
+                yield chunk
+                if progress:
+                    await progress(sent, file_size)
+            if sent != file_size:
+                raise Exception(f"Upload stream ended early ({sent}/{file_size} bytes)")
+            yield tail
+
+        headers = {
+            'Content-Type': f"multipart/form-data; boundary={boundary}",
+            'Content-Length': str(len(head) + file_size + len(tail))
+        }
+        timeout = aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout
+        )
+
+        # A streamed body can't be replayed, so uploads are never retried here
+        try:
+            async with http_client.session.post(url, data=body(), headers=headers, timeout=timeout) as response:
+                text = await response.text()
+        except asyncio.TimeoutError:
+            metrics.inc('hydrax_api_requests_total', result='timeout')
+            raise
+        except aiohttp.ClientError:
+            metrics.inc('hydrax_api_requests_total', result='connection_error')
+            raise
+
+        if response.status == 200:
+            metrics.inc('hydrax_api_requests_total', result='ok')
+            return json.loads(text)
         else:
-            raise Exception(f"Upload failed: {response.text}")
-    
+            metrics.inc('hydrax_api_requests_total', result=f"http_{response.status}")
+            raise Exception(f"Upload failed: {text}")
+
+    async def _read_file(self, file_path: str) -> AsyncIterator[bytes]:
+        """Read a file in fixed-size chunks without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def current_api_key(self) -> Optional[str]:
+        """Get the key set with /hapi, falling back to HYDRAX_API_ID"""
+        return db.get_config('hydrax_api_key') or self.api_key
+
     def update_api_key(self, new_key: str):
-        """Update Hydrax API key"""
-        self.api_key = new_key
+        """Update Hydrax API key
+
+        Stored in the database so worker processes upload with it too.
+        """
+        db.set_config('hydrax_api_key', new_key)
 
 hydrax_api = HydraxAPI()
@@ -0,0 +1,123 @@
+import json
+import os
+import string
+import time
+from typing import Dict, Set
+from utils.logger import logger
+
+# The fields callers pass to .format() for each string, strings not listed take none
+PLACEHOLDERS: Dict[str, Set[str]] = {
+    'processing_queue': {'page', 'pages', 'count', 'size', 'eta', 'queue', 'next_item'},
+    'uploading': {'filename', 'progress_bar', 'percentage', 'speed', 'eta', 'next_item'},
+    'downloading': {'filename', 'progress_bar', 'percentage', 'speed', 'eta'},
+    'upload_complete': {'filename', 'url'},
+    'upload_failed': {'error'},
+    'ping_result': {'ms'},
+    'user_added': {'user_id'},
+    'user_removed': {'user_id'},
+    'ads_confirm': {'message'},
+    'ads_sent': {'success', 'failed', 'blocked'},
+    'hydrax_api_confirm': {'api_key'},
+}
+
+class LanguageCatalog:
+    """All language files, loaded once and reloaded when they change on disk"""
+
+    def __init__(self, directory: str = 'lang', default: str = 'en'):
+        self.directory = directory
+        self.default = default
+        self.reload_interval = float(os.getenv('LANG_RELOAD_INTERVAL') or 5)
+        self.strings: Dict[str, Dict[str, str]] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._checked_at = 0.0
+        self.load()
+
+    @staticmethod
+    def _placeholders(text: str) -> Set[str]:
+        """Get the format fields used in a string, raising on malformed braces"""
+        return {field for _, field, _, _ in string.Formatter().parse(text) if field is not None}
+
+    def _scan(self) -> Dict[str, float]:
+        """Get the modification time of every language file"""
+        mtimes = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json') and entry.is_file():
+                mtimes[entry.name[:-5]] = entry.stat().st_mtime
+        return mtimes
+
+    def _read(self, code: str) -> Dict[str, str]:
+        """Read and parse a single language file"""
+        with open(os.path.join(self.directory, f"{code}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _validate(self, code: str, strings: Dict[str, str]) -> Dict[str, str]:
+        """Drop strings whose placeholders would break .format() for callers
+
+        Every language, the default included, is checked against the
+        fields callers actually pass (PLACEHOLDERS).
+        """
+        valid = {}
+
+        for key, text in strings.items():
+            expected = PLACEHOLDERS.get(key, set())
+            try:
+                fields = self._placeholders(text)
+            except ValueError as e:
+                logger.error(f"lang/{code}.json: '{key}' is not a valid format string: {e}")
+                continue
+
+            unknown = fields - expected
+            if unknown:
+                logger.error(
+                    f"lang/{code}.json: '{key}' uses unknown placeholders {sorted(unknown)}"
+                )
+                continue
+
+            valid[key] = text
+
+        return valid
+
+    def load(self):
+        """Load every language file, the default language first"""
+        mtimes = self._scan()
+        codes = sorted(mtimes, key=lambda code: code != self.default)
+
+        for code in codes:
+            try:
+                self.strings[code] = self._validate(code, self._read(code))
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load lang/{code}.json: {e}")
+
+        self._mtimes = mtimes
+        self._checked_at = time.monotonic()
+
+    def _maybe_reload(self):
+        """Reload the catalog if a language file was added or modified"""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtimes = self._scan()
+        except OSError:
+            return
+
+        if mtimes != self._mtimes:
+            logger.info("Language files changed, reloading")
+            self.load()
+
+    def get(self, lang: str, key: str) -> str:
+        """Get a string in the given language, falling back to the default, then the key"""
+        self._maybe_reload()
+
+        text = self.strings.get(lang, {}).get(key)
+        if text is None:
+            text = self.strings.get(self.default, {}).get(key, key)
+        return text
+
+    def languages(self) -> Set[str]:
+        """Get the available language codes"""
+        return set(self.strings)
+
+catalog = LanguageCatalog()
@@ -1,20 +1,208 @@
+import atexit
+import copy
+import gzip
+import json
 import logging
 import os
+import queue
+import shutil
+import time
+from contextvars import ContextVar
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional
+
+LOG_FILE = os.getenv('LOG_FILE') or 'bot.log'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Fields callers attach with extra= or set_log_context(), written out in JSON lines
+CONTEXT_FIELDS = ('item_id', 'user_id', 'worker', 'stage', 'duration', 'bytes')
+
+log_context: ContextVar[Dict[str, Any]] = ContextVar('log_context', default={})
+
+def set_log_context(**fields):
+    """Attach fields such as item_id to every record logged from the current task"""
+    log_context.set(fields)
+
+class ContextFilter(logging.Filter):
+    """Copy the current task's log context onto each record
+
+    Runs in the thread that logged, before the record is queued, so the
+    context of the task that logged is the one that ends up on the line.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON lines with their context fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogQueueHandler(QueueHandler):
+    """Queue records with their arguments merged and the traceback rendered
+
+    The stock handler folds the traceback into the message, which leaves
+    JsonFormatter nothing to put in its exception field. The traceback is
+    kept in exc_text instead, where every formatter knows to find it.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatter.formatException(record.exc_info)
+            # Traceback objects keep every frame alive until the listener gets to them
+            record.exc_info = None
+        return record
+
+class RotatingLogHandler(RotatingFileHandler):
+    """Rotate on size or age, gzipping the segments rotated out
+
+    Segments are numbered like RotatingFileHandler's (bot.log.1.gz is the
+    newest), and the file also rolls over once it is older than interval
+    seconds when an interval is set.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, interval: float, backup_count: int, compress: bool):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+        if compress:
+            self.namer = lambda name: name + '.gz'
+            self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
 
 def setup_logger():
-    """Setup bot logging"""
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format=log_format,
-        handlers=[
-            logging.FileHandler('bot.log'),
-            logging.StreamHandler()
-        ]
+    """Setup bot logging
+
+    Records are put on a queue and written by a background thread, so
+    logging from the event loop never waits on the disk.
+    """
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    structured = os.getenv('LOG_FORMAT', 'text').lower() == 'json'
+
+    file_handler = RotatingLogHandler(
+        LOG_FILE,
+        max_bytes=int(os.getenv('LOG_MAX_BYTES') or 10 * 1024 * 1024),
+        interval=float(os.getenv('LOG_ROTATE_INTERVAL') or 0),
+        backup_count=int(os.getenv('LOG_BACKUP_COUNT') or 5),
+        compress=os.getenv('LOG_COMPRESS', 'true').lower() in ('1', 'true', 'yes')
     )
-    
+    file_handler.setFormatter(JsonFormatter() if structured else logging.Formatter(TEXT_FORMAT))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.setFormatter(logging.Formatter())
+    logging.basicConfig(level=level, handlers=[queue_handler])
+
+    listener = QueueListener(records, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued on the way out
+    atexit.register(listener.stop)
+
     return logging.getLogger(__name__)
 
+def _segments() -> List[str]:
+    """Get the log file and its rotated segments, newest first"""
+    paths = [LOG_FILE]
+    index = 1
+    while True:
+        for path in (f"{LOG_FILE}.{index}", f"{LOG_FILE}.{index}.gz"):
+            if os.path.exists(path):
+                paths.append(path)
+                break
+        else:
+            return [path for path in paths if os.path.exists(path)]
+        index += 1
+
+def _read_segment(path: str) -> List[str]:
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        return f.read().splitlines()
+
+def _line_time(line: str) -> Optional[float]:
+    """Get the timestamp of a text or JSON log line, None for continuation lines"""
+    try:
+        if line.startswith('{'):
+            return datetime.fromisoformat(json.loads(line)['time']).timestamp()
+        return datetime.strptime(line[:23], '%Y-%m-%d %H:%M:%S,%f').timestamp()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def _lines_newest_first() -> Iterator[List[str]]:
+    """Yield the lines of each segment, starting with the current file"""
+    for path in _segments():
+        try:
+            yield _read_segment(path)
+        except OSError:
+            continue
+
+def read_log(lines: int = 200, since: Optional[float] = None) -> str:
+    """Get the last lines of the log, or every line written after since
+
+    Rotated segments are only opened when the current file doesn't reach
+    far enough back.
+    """
+    collected: List[str] = []
+    for segment in _lines_newest_first():
+        if since is None:
+            collected = segment[-(lines - len(collected)):] + collected
+            if len(collected) >= lines:
+                break
+            continue
+
+        # Keep records from the window, with the traceback lines that follow them
+        start = len(segment)
+        reached = False
+        for index in range(len(segment) - 1, -1, -1):
+            stamp = _line_time(segment[index])
+            if stamp is None:
+                continue
+            if stamp < since:
+                reached = True
+                break
+            start = index
+        collected = segment[start:] + collected
+        if reached:
+            break
+
+    return "\n".join(collected)
+
 logger = setup_logger()
@@ -0,0 +1,323 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Probes run in child processes, so this module sticks to the standard
+# library and never logs: importing the bot's logger there would open
+# bot.log from a second process.
+
+# Largest moov / Tracks header we are willing to read into memory
+MAX_HEADER_SIZE = 64 * 1024 * 1024
+
+# Atoms a QuickTime / MP4 file may open with, older QuickTime files have no ftyp
+MP4_FIRST_ATOMS = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot', b'uuid'}
+MP4_BRANDS = {b'qt  ': ('mov', 'video/quicktime'), b'3gp': ('3gp', 'video/3gpp'), b'3g2': ('3gp', 'video/3gpp2')}
+MATROSKA_TYPES = {'webm': ('webm', 'video/webm'), 'matroska': ('mkv', 'video/x-matroska')}
+
+class InvalidMedia(Exception):
+    """The payload isn't a usable video, retrying won't help"""
+
+class TruncatedMedia(Exception):
+    """The file ends before its container says it does, a fresh download may fix it"""
+
+def _mp4_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, body start, body end) of the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise InvalidMedia(f"Corrupt MP4 box {box_type!r}")
+        yield box_type, pos + header, pos + size
+        pos += size
+
+def _probe_mp4(f, file_size: int) -> Dict[str, Any]:
+    """Walk the top-level boxes and read duration and tracks from moov"""
+    # Without an ftyp box this is a QuickTime file from before the MP4 spec
+    info: Dict[str, Any] = {'container': 'mov', 'mime_type': 'video/quicktime'}
+    moov = None
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            raise InvalidMedia(f"Corrupt MP4 box {box_type!r}")
+        if pos + size > file_size:
+            raise TruncatedMedia(f"MP4 box {box_type.decode(errors='replace')} runs past the end of the file")
+
+        if box_type == b'ftyp':
+            info['container'], info['mime_type'] = 'mp4', 'video/mp4'
+            brand = header[8:12]
+            for prefix, (container, mime_type) in MP4_BRANDS.items():
+                if brand.startswith(prefix):
+                    info['container'], info['mime_type'] = container, mime_type
+        elif box_type == b'moov':
+            if size > MAX_HEADER_SIZE:
+                raise InvalidMedia("MP4 header is implausibly large")
+            f.seek(pos + header_size)
+            moov = f.read(size - header_size)
+        pos += size
+
+    if moov is None:
+        raise TruncatedMedia("MP4 has no moov box, the file is incomplete")
+
+    tracks = []
+    for box_type, start, end in _mp4_boxes(moov):
+        if box_type == b'mvhd':
+            if moov[start] == 1:
+                timescale, duration = struct.unpack('>IQ', moov[start + 20:start + 32])
+            else:
+                timescale, duration = struct.unpack('>II', moov[start + 12:start + 20])
+            if timescale:
+                info['duration'] = round(duration / timescale, 3)
+        elif box_type == b'trak':
+            tracks.append(_mp4_track(moov, start, end))
+
+    _add_tracks(info, tracks)
+    return info
+
+def _mp4_track(data: bytes, start: int, end: int) -> Dict[str, Any]:
+    """Read the handler type and first sample entry of a trak box"""
+    track: Dict[str, Any] = {}
+    for box_type, body, box_end in _mp4_boxes(data, start, end):
+        if box_type in (b'mdia', b'minf', b'stbl'):
+            track.update(_mp4_track(data, body, box_end))
+        elif box_type == b'hdlr':
+            handler = data[body + 8:body + 12]
+            track['kind'] = {b'vide': 'video', b'soun': 'audio'}.get(handler, handler.decode(errors='replace'))
+        elif box_type == b'stsd' and box_end - body >= 16:
+            track['codec'] = data[body + 12:body + 16].decode(errors='replace').strip()
+            if box_end - body >= 44:
+                track['width'], track['height'] = struct.unpack('>HH', data[body + 40:body + 44])
+    return track
+
+def _read_vint(f, keep_marker: bool = False) -> Tuple[Optional[int], int]:
+    """Read an EBML variable-length integer, returning (value, length)"""
+    first = f.read(1)
+    if not first:
+        raise TruncatedMedia("Matroska element cut off")
+    byte = first[0]
+    length = 1
+    while length <= 8 and not byte & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise InvalidMedia("Corrupt Matroska element")
+
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        raise TruncatedMedia("Matroska element cut off")
+    value = byte if keep_marker else byte & (0xFF >> length)
+    for b in rest:
+        value = (value << 8) | b
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        # All ones means the size isn't known
+        return None, length
+    return value, length
+
+def _ebml_elements(f, end: int) -> Iterator[Tuple[int, Optional[int], int]]:
+    """Yield (id, size, body start) of the elements up to end"""
+    while f.tell() < end:
+        element_id, _ = _read_vint(f, keep_marker=True)
+        size, _ = _read_vint(f)
+        body = f.tell()
+        yield element_id, size, body
+        if size is None:
+            # Only Segment and Cluster use unknown sizes, and we stop before Cluster
+            return
+        f.seek(body + size)
+
+def _ebml_read(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) < size:
+        raise TruncatedMedia("Matroska element cut off")
+    return data
+
+def _ebml_uint(f, size: int) -> int:
+    return int.from_bytes(_ebml_read(f, size), 'big')
+
+def _probe_matroska(f, file_size: int) -> Dict[str, Any]:
+    """Read the doc type, Segment size, Info and Tracks of a Matroska/WebM file"""
+    info: Dict[str, Any] = {'container': 'mkv', 'mime_type': 'video/x-matroska'}
+    f.seek(0)
+    _read_vint(f, keep_marker=True)
+    header_size, _ = _read_vint(f)
+    header_end = f.tell() + (header_size or 0)
+    for element_id, size, body in _ebml_elements(f, header_end):
+        if element_id == 0x4282:
+            doc_type = _ebml_read(f, size).decode(errors='replace').rstrip('\0')
+            if doc_type not in MATROSKA_TYPES:
+                raise InvalidMedia(f"Unsupported EBML document type {doc_type}")
+            info['container'], info['mime_type'] = MATROSKA_TYPES[doc_type]
+
+    f.seek(header_end)
+    segment_id, _ = _read_vint(f, keep_marker=True)
+    if segment_id != 0x18538067:
+        raise InvalidMedia("Matroska file has no Segment")
+    segment_size, _ = _read_vint(f)
+    segment_start = f.tell()
+    segment_end = file_size if segment_size is None else segment_start + segment_size
+    if segment_end > file_size:
+        raise TruncatedMedia("Matroska Segment runs past the end of the file")
+
+    timecode_scale, duration = 1000000, None
+    tracks = []
+    for element_id, size, body in _ebml_elements(f, segment_end):
+        if size is None or element_id == 0x1F43B675:
+            # Cluster data follows, the headers we need come before it
+            break
+        if size > MAX_HEADER_SIZE:
+            continue
+
+        if element_id == 0x1549A966:
+            for child_id, child_size, _ in _ebml_elements(f, body + size):
+                if child_id == 0x2AD7B1:
+                    timecode_scale = _ebml_uint(f, child_size)
+                elif child_id == 0x4489:
+                    duration = struct.unpack('>f' if child_size == 4 else '>d', _ebml_read(f, child_size))[0]
+        elif element_id == 0x1654AE6B:
+            for child_id, child_size, child_body in _ebml_elements(f, body + size):
+                if child_id == 0xAE:
+                    tracks.append(_matroska_track(f, child_body + child_size))
+        f.seek(body + size)
+
+    if duration is not None:
+        info['duration'] = round(duration * timecode_scale / 1e9, 3)
+    _add_tracks(info, tracks)
+    return info
+
+def _matroska_track(f, end: int) -> Dict[str, Any]:
+    """Read the type, codec and picture size of a TrackEntry"""
+    track: Dict[str, Any] = {}
+    for element_id, size, body in _ebml_elements(f, end):
+        if element_id == 0x83:
+            track['kind'] = {1: 'video', 2: 'audio'}.get(_ebml_uint(f, size), 'other')
+        elif element_id == 0x86:
+            track['codec'] = _ebml_read(f, size).decode(errors='replace')
+        elif element_id == 0xE0:
+            for child_id, child_size, _ in _ebml_elements(f, body + size):
+                if child_id == 0xB0:
+                    track['width'] = _ebml_uint(f, child_size)
+                elif child_id == 0xBA:
+                    track['height'] = _ebml_uint(f, child_size)
+    return track
+
+def _add_tracks(info: Dict[str, Any], tracks):
+    """Copy the first video and audio track's details into info, rejecting files without video"""
+    video = next((track for track in tracks if track.get('kind') == 'video'), None)
+    audio = next((track for track in tracks if track.get('kind') == 'audio'), None)
+    if video is None:
+        raise InvalidMedia("File has no video track")
+
+    info['video_codec'] = video.get('codec')
+    if video.get('width') and video.get('height'):
+        info['width'], info['height'] = video['width'], video['height']
+    if audio is not None:
+        info['audio_codec'] = audio.get('codec')
+
+def _describe_non_video(head: bytes) -> Optional[str]:
+    """Name what a payload that clearly isn't a video is, None when it may be one"""
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith((b'<!doctype html', b'<html', b'<head', b'<body')):
+        return "an HTML page"
+    if text.startswith((b'<?xml', b'<')):
+        return "an XML document"
+    if text.startswith((b'{', b'[')):
+        return "a JSON document"
+    return None
+
+def _probe_container(f, head: bytes, file_size: int) -> Dict[str, Any]:
+    """Identify the container from the first bytes and parse its headers"""
+    if head[4:8] in MP4_FIRST_ATOMS:
+        return _probe_mp4(f, file_size)
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return _probe_matroska(f, file_size)
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        if struct.unpack('<I', head[4:8])[0] + 8 > file_size:
+            raise TruncatedMedia("AVI file is shorter than its RIFF header says")
+        return {'container': 'avi', 'mime_type': 'video/x-msvideo'}
+    if head[:3] == b'FLV':
+        return {'container': 'flv', 'mime_type': 'video/x-flv'}
+    if head[:8] == b'\x30\x26\xb2\x75\x8e\x66\xcf\x11':
+        return {'container': 'asf', 'mime_type': 'video/x-ms-asf'}
+    if head[:4] == b'\x00\x00\x01\xba':
+        return {'container': 'mpeg', 'mime_type': 'video/mpeg'}
+    if len(head) > 376 and head[0] == head[188] == head[376] == 0x47:
+        return {'container': 'ts', 'mime_type': 'video/mp2t'}
+    # M2TS prefixes each 188-byte packet with a 4-byte timecode
+    if len(head) > 388 and head[4] == head[196] == head[388] == 0x47:
+        return {'container': 'm2ts', 'mime_type': 'video/mp2t'}
+    if head[:4] == b'OggS':
+        return {'container': 'ogg', 'mime_type': 'video/ogg'}
+
+    description = _describe_non_video(head)
+    if description:
+        raise InvalidMedia(f"File is {description}")
+    # Not a container we parse, leave the MIME type to the file name
+    return {'container': 'unknown'}
+
+def inspect_file(file_path: str) -> Dict[str, Any]:
+    """Identify a video file's container, MIME type, duration and codecs
+
+    Raises InvalidMedia for payloads that clearly aren't video and
+    TruncatedMedia when the container is cut short. Containers it doesn't
+    recognise pass with no MIME type. Only headers are read, so this is
+    cheap even for multi-gigabyte files.
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size == 0:
+        raise InvalidMedia("File is empty")
+
+    with open(file_path, 'rb') as f:
+        head = f.read(512)
+        try:
+            info = _probe_container(f, head, file_size)
+        except (struct.error, IndexError) as e:
+            # Box and element headers too short for what they claim to hold
+            raise InvalidMedia(f"Container headers are malformed: {e}")
+
+    info['size'] = file_size
+    return info
+
+class MediaProber:
+    """Runs inspect_file in a small process pool, off the event loop
+
+    The pool is created on first use with the fork start method: spawned
+    children would re-import the bot's entry script.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv('MEDIA_PROBE', 'true').lower() in ('1', 'true', 'yes')
+        self.workers = int(os.getenv('MEDIA_PROBE_WORKERS') or 2)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def inspect(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Probe a downloaded file, or return None when probing is turned off"""
+        if not self.enabled:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+        return await asyncio.get_running_loop().run_in_executor(self._pool, inspect_file, file_path)
+
+    def close(self):
+        """Stop the probe processes"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+media_prober = MediaProber()
@@ -0,0 +1,232 @@
+import bisect
+import functools
+import inspect
+import math
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from aiohttp import web
+from utils.logger import logger
+
+# Histogram bucket bounds, in seconds and bytes per second
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SPEED_BUCKETS = tuple(2 ** n * 1024 for n in range(6, 18))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Metrics:
+    """In-process counters, gauges and histograms
+
+    Every series keeps cumulative totals for the Prometheus endpoint and a
+    bounded window of timestamped samples, so /stats can report
+    percentiles and rates over the last few minutes or hours.
+    """
+
+    def __init__(self):
+        self.window = float(os.getenv('METRICS_WINDOW') or 3600)
+        self.max_samples = int(os.getenv('METRICS_MAX_SAMPLES') or 10000)
+        self.host = os.getenv('METRICS_HOST') or '127.0.0.1'
+        self.port = int(os.getenv('METRICS_PORT') or 0)
+        self._types: Dict[str, str] = {}
+        self._help: Dict[str, str] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._values: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List]] = {}
+        self._samples: Dict[str, Dict[Labels, deque]] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    def counter(self, name: str, help_text: str):
+        """Declare a monotonically increasing counter"""
+        self._declare(name, 'counter', help_text)
+
+    def gauge(self, name: str, help_text: str):
+        """Declare a value that can go up and down"""
+        self._declare(name, 'gauge', help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        """Declare a distribution of observed values"""
+        self._declare(name, 'histogram', help_text)
+        self._buckets[name] = tuple(sorted(buckets))
+
+    def _declare(self, name: str, kind: str, help_text: str):
+        self._types[name] = kind
+        self._help[name] = help_text
+        self._values.setdefault(name, {})
+        self._histograms.setdefault(name, {})
+        self._samples.setdefault(name, {})
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a callback that refreshes gauges right before they are read"""
+        self._collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter"""
+        key = self._key(labels)
+        series = self._values[name]
+        series[key] = series.get(key, 0) + value
+        self._sample(name, key, value)
+
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge"""
+        self._values[name][self._key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a value in a histogram"""
+        key = self._key(labels)
+        buckets = self._buckets[name]
+        state = self._histograms[name].get(key)
+        if state is None:
+            state = self._histograms[name][key] = [[0] * len(buckets), 0.0, 0]
+
+        index = bisect.bisect_left(buckets, value)
+        if index < len(buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+        self._sample(name, key, value)
+
+    @staticmethod
+    def _key(labels: dict) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _sample(self, name: str, key: Labels, value: float):
+        """Remember a timestamped sample for windowed queries"""
+        samples = self._samples[name].get(key)
+        if samples is None:
+            samples = self._samples[name][key] = deque(maxlen=self.max_samples)
+
+        now = time.monotonic()
+        samples.append((now, value))
+        while samples and samples[0][0] < now - self.window:
+            samples.popleft()
+
+    def _window(self, name: str, seconds: float, **labels) -> List[float]:
+        """Get the sample values of matching series from the last seconds"""
+        since = time.monotonic() - seconds
+        wanted = set(self._key(labels))
+        values = []
+        for key, samples in self._samples.get(name, {}).items():
+            if wanted.issubset(key):
+                values.extend(value for at, value in samples if at >= since)
+        return values
+
+    def percentiles(self, name: str, seconds: float, pcts=(50, 95, 99), **labels) -> Tuple[int, List[float]]:
+        """Get the sample count and nearest-rank percentiles over a window"""
+        values = sorted(self._window(name, seconds, **labels))
+        if not values:
+            return 0, []
+        return len(values), [values[max(0, math.ceil(p / 100 * len(values)) - 1)] for p in pcts]
+
+    def total(self, name: str, seconds: float, **labels) -> float:
+        """Sum a counter's increments over a window"""
+        return sum(self._window(name, seconds, **labels))
+
+    def value(self, name: str, **labels) -> float:
+        """Get the current value of a counter or gauge series"""
+        self._collect()
+        return self._values[name].get(self._key(labels), 0)
+
+    def _collect(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+
+    def render(self) -> str:
+        """Format every series in the Prometheus text exposition format"""
+        self._collect()
+        lines = []
+        for name, kind in self._types.items():
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            if kind != 'histogram':
+                for key, value in self._values[name].items():
+                    lines.append(f"{name}{self._format_labels(key)} {self._format_value(value)}")
+                continue
+
+            buckets = self._buckets[name]
+            for key, (counts, total, count) in self._histograms[name].items():
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(key + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self._format_labels(key)} {self._format_value(total)}")
+                lines.append(f"{name}_count{self._format_labels(key)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    @staticmethod
+    def _format_labels(key: Labels) -> str:
+        if not key:
+            return ""
+        escaped = (
+            (k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in key
+        )
+        return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+    async def start_server(self):
+        """Serve /metrics over HTTP when METRICS_PORT is set"""
+        if not self.port or self._runner:
+            return
+
+        async def handle(request):
+            return web.Response(
+                body=self.render().encode(),
+                headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+            )
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop_server(self):
+        """Stop the metrics endpoint"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def instrument_handlers(self, client):
+        """Time every registered pyrogram handler callback"""
+        for handlers in client.dispatcher.groups.values():
+            for handler in handlers:
+                callback = handler.callback
+                if inspect.iscoroutinefunction(callback) and not hasattr(callback, '__wrapped__'):
+                    handler.callback = self._timed(callback)
+
+    def _timed(self, callback):
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                self.observe('hydrax_handler_seconds', time.perf_counter() - started, handler=callback.__name__)
+        return wrapper
+
+metrics = Metrics()
+
+metrics.gauge('hydrax_queue_items', "Queue items by status")
+metrics.gauge('hydrax_workers_busy', "Workers currently holding a queue item")
+metrics.histogram('hydrax_queue_wait_seconds', "Time from enqueueing an item to a worker claiming it")
+metrics.histogram('hydrax_transfer_seconds', "Duration of a download, upload or relay", DURATION_BUCKETS)
+metrics.histogram('hydrax_transfer_speed_bytes', "Average bytes per second of a transfer", SPEED_BUCKETS)
+metrics.counter('hydrax_transfer_bytes_total', "Bytes moved by finished transfers")
+metrics.counter('hydrax_items_total', "Queue items by outcome")
+metrics.counter('hydrax_api_requests_total', "Hydrax upload requests by result")
+metrics.counter('hydrax_floodwaits_total', "FloodWait errors by source")
+metrics.counter('hydrax_floodwait_seconds_total', "Seconds Telegram asked us to wait, by source")
+metrics.histogram('hydrax_handler_seconds', "Time spent in each bot handler", LATENCY_BUCKETS)
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from typing import Callable, List, Optional, Set, Tuple
+from pyrogram.errors import FloodWait
+from utils.helpers import create_progress_bar, format_bytes
+from utils.logger import logger
+from utils.metrics import metrics
+
+# Final edits waiting out a FloodWait, kept referenced after their reporter is gone
+_pending_edits: Set[asyncio.Task] = set()
+
+class ProgressReporter:
+    """Rate-limited transfer progress on a single status message
+
+    Transfers call the reporter as a progress(current, total) callback as
+    often as they like; it only records the counters and edits the message
+    at most once per interval, in the background, backing off on FloodWait.
+    """
+
+    def __init__(self, status_msg, file_name: str, footer: Optional[Callable[[], str]] = None):
+        self.status_msg = status_msg
+        self.file_name = file_name
+        self.footer = footer
+        self.interval = float(os.getenv('PROGRESS_INTERVAL') or 5)
+        self.alpha = float(os.getenv('PROGRESS_SMOOTHING') or 0.3)
+        self._next_edit = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+        self.phase("")
+
+    def phase(self, title: str) -> "ProgressReporter":
+        """Start reporting a new transfer phase"""
+        self.title = title
+        self.current = 0
+        self.total = 0
+        self.speed: Optional[float] = None
+        self.segments: List[Tuple[int, int]] = []
+        self._sample_time = time.monotonic()
+        self._sample_bytes = 0
+        return self
+
+    async def __call__(self, current: int, total: int):
+        self.current = current
+        self.total = total
+
+        now = time.monotonic()
+        if now < self._next_edit or (self._edit_task and not self._edit_task.done()):
+            return
+
+        self._sample(now)
+        self._next_edit = now + self.interval
+        self._edit_task = asyncio.create_task(self._edit(self.render()))
+
+    def set_segments(self, segments: List[Tuple[int, int]]):
+        """Record (done, total) counters for each parallel segment of the transfer"""
+        self.segments = segments
+
+    def _sample(self, now: float):
+        """Fold the bytes moved since the last sample into the smoothed speed"""
+        elapsed = now - self._sample_time
+        if elapsed <= 0:
+            return
+
+        rate = (self.current - self._sample_bytes) / elapsed
+        if self.speed is None:
+            self.speed = rate
+        else:
+            self.speed = self.alpha * rate + (1 - self.alpha) * self.speed
+
+        self._sample_time = now
+        self._sample_bytes = self.current
+
+    def eta(self) -> str:
+        """Estimate the remaining time from the smoothed speed"""
+        if not self.total or not self.speed:
+            return "∞"
+        return f"{(self.total - self.current) / self.speed:.1f}s"
+
+    def render(self) -> str:
+        """Build the status text for the current counters"""
+        speed = format_bytes(self.speed) if self.speed else "0 B"
+
+        if self.total:
+            bar = create_progress_bar(min(self.current, self.total), self.total)
+            percentage = (self.current / self.total) * 100
+            progress = f"{bar} {percentage:.1f}%"
+        else:
+            progress = format_bytes(self.current)
+
+        text = (
+            f"{self.title}\n\n"
+            f"**File:** {self.file_name}\n"
+            f"**Progress:** {progress}\n"
+            f"**Speed:** {speed}/s\n"
+            f"**ETA:** {self.eta()}"
+        )
+        if self.segments:
+            bars = " ".join(create_progress_bar(done, total, length=5) for done, total in self.segments)
+            text += f"\n**Segments:** {bars}"
+        if self.footer:
+            text += f"\n\n**Next:** {self.footer()}"
+        return text
+
+    async def _edit(self, text: str):
+        """Edit the status message, pushing the next edit back on FloodWait"""
+        try:
+            await self.status_msg.edit_text(text)
+        except FloodWait as e:
+            logger.warning(f"FloodWait of {e.value}s on progress update")
+            self._count_flood_wait(e.value)
+            self._next_edit = time.monotonic() + e.value
+        except Exception:
+            pass
+
+    @staticmethod
+    def _count_flood_wait(seconds: float):
+        metrics.inc('hydrax_floodwaits_total', source='progress')
+        metrics.inc('hydrax_floodwait_seconds_total', seconds, source='progress')
+
+    async def update(self, text: str):
+        """Replace the status text outright
+
+        On FloodWait the edit is retried in the background once the wait is
+        over, so the worker isn't held up by a status message.
+        """
+        if self._edit_task and not self._edit_task.done():
+            self._edit_task.cancel()
+            await asyncio.gather(self._edit_task, return_exceptions=True)
+
+        try:
+            await self.status_msg.edit_text(text)
+        except FloodWait as e:
+            self._count_flood_wait(e.value)
+            self._next_edit = time.monotonic() + e.value
+            self._edit_task = asyncio.create_task(self._edit_later(text, e.value))
+            _pending_edits.add(self._edit_task)
+            self._edit_task.add_done_callback(_pending_edits.discard)
+            return
+        except Exception as e:
+            logger.warning(f"Failed to update status message: {e}")
+
+        self._next_edit = time.monotonic() + self.interval
+
+    async def _edit_later(self, text: str, delay: float):
+        """Send a replacement text once a FloodWait is over"""
+        await asyncio.sleep(delay)
+        try:
+            await self.status_msg.edit_text(text)
+        except Exception as e:
+            logger.warning(f"Failed to update status message: {e}")
@@ -0,0 +1,88 @@
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+class RelayBuffer:
+    """Bounded in-memory pipe between a download and an upload"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._chunks = deque()
+        self._size = 0
+        self._eof = False
+        self._error = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    async def write(self, chunk: bytes):
+        """Append a chunk, waiting while the buffer is full"""
+        while self._size >= self.max_bytes and self._error is None:
+            self._writable.clear()
+            await self._writable.wait()
+
+        if self._error is not None:
+            raise self._error
+
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        self._readable.set()
+
+    def close(self):
+        """Signal that no more chunks will be written"""
+        self._eof = True
+        self._readable.set()
+
+    def abort(self, error: BaseException):
+        """Fail both ends of the pipe"""
+        self._error = error
+        self._readable.set()
+        self._writable.set()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while True:
+            while not self._chunks and not self._eof and self._error is None:
+                self._readable.clear()
+                await self._readable.wait()
+
+            if self._error is not None:
+                raise self._error
+            if not self._chunks:
+                return
+
+            chunk = self._chunks.popleft()
+            self._size -= len(chunk)
+            self._writable.set()
+            yield chunk
+
+async def relay(
+    source: AsyncIterator[bytes],
+    upload: Callable[[AsyncIterator[bytes]], Awaitable[Any]],
+    max_buffer: int
+) -> Any:
+    """Stream source into upload through a bounded buffer, overlapping both"""
+    buffer = RelayBuffer(max_buffer)
+
+    async def pump():
+        try:
+            async for chunk in source:
+                await buffer.write(chunk)
+        except Exception as e:
+            buffer.abort(e)
+            raise
+        finally:
+            buffer.close()
+
+    pump_task = asyncio.create_task(pump())
+
+    try:
+        result = await upload(buffer)
+    except BaseException as e:
+        buffer.abort(e if isinstance(e, Exception) else Exception("Relay aborted"))
+        pump_task.cancel()
+        await asyncio.gather(pump_task, return_exceptions=True)
+        raise
+
+    # Surface download errors that happened after the upload finished
+    await pump_task
+    return result
@@ -0,0 +1,106 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+from utils.logger import logger
+
+Item = Dict[str, Any]
+
+class Scheduler:
+    """Decide the order pending queue items are claimed in
+
+    The base policy is plain FIFO. Every policy puts the creator's items
+    first when SCHEDULER_CREATOR_PRIORITY is on.
+    """
+
+    def __init__(self):
+        self.creator_id = int(os.getenv('CREATOR_ID') or 0)
+        self.creator_priority = os.getenv('SCHEDULER_CREATOR_PRIORITY', 'true').lower() in ('1', 'true', 'yes')
+
+    def order(self, pending: List[Item], active: Optional[List[Item]] = None) -> List[Item]:
+        """Sort claimable items into the order workers will pick them up"""
+        active = active or []
+        if not self.creator_priority:
+            return self._order(pending, active)
+
+        creator = [item for item in pending if item['user_id'] == self.creator_id]
+        others = [item for item in pending if item['user_id'] != self.creator_id]
+        return self._order(creator, active) + self._order(others, active)
+
+    def served(self, item: Item):
+        """Note that a worker claimed item"""
+
+    def item_key(self, item: Item, now: float):
+        return item['created_at']
+
+    def _order(self, items: List[Item], active: List[Item]) -> List[Item]:
+        now = time.time()
+        return sorted(items, key=lambda item: self.item_key(item, now))
+
+class ShortestJobFirstScheduler(Scheduler):
+    """Smallest items first, with aging so large items still make progress
+
+    An item's effective size halves for every SCHEDULER_AGING seconds it
+    has waited, so a big upload eventually outranks fresh small ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.aging = float(os.getenv('SCHEDULER_AGING') or 1800)
+        self.unknown_size = int(os.getenv('SCHEDULER_UNKNOWN_SIZE') or 512 * 1024 * 1024)
+
+    def item_key(self, item: Item, now: float):
+        size = item.get('file_size') or self.unknown_size
+        waited = max(0.0, now - item['created_at'])
+        return size * 0.5 ** (waited / self.aging)
+
+class FairShareScheduler(ShortestJobFirstScheduler):
+    """Round-robin across users, so one user's backlog can't starve the rest
+
+    Users without active items and those served longest ago go first in
+    each round. Within a user, items run shortest first with aging, or in
+    arrival order when SCHEDULER_SIZE_AWARE is off.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.size_aware = os.getenv('SCHEDULER_SIZE_AWARE', 'true').lower() in ('1', 'true', 'yes')
+        self.last_served: Dict[int, float] = {}
+
+    def served(self, item: Item):
+        self.last_served[item['user_id']] = time.monotonic()
+
+    def item_key(self, item: Item, now: float):
+        if self.size_aware:
+            return super().item_key(item, now)
+        return item['created_at']
+
+    def _order(self, items: List[Item], active: List[Item]) -> List[Item]:
+        by_user: Dict[int, List[Item]] = {}
+        for item in super()._order(items, active):
+            by_user.setdefault(item['user_id'], []).append(item)
+
+        running: Dict[int, int] = {}
+        for item in active:
+            running[item['user_id']] = running.get(item['user_id'], 0) + 1
+
+        users = sorted(by_user, key=lambda user_id: (running.get(user_id, 0), self.last_served.get(user_id, 0.0)))
+        ordered = []
+        for index in range(max((len(user_items) for user_items in by_user.values()), default=0)):
+            for user_id in users:
+                if index < len(by_user[user_id]):
+                    ordered.append(by_user[user_id][index])
+        return ordered
+
+SCHEDULERS = {
+    'fifo': Scheduler,
+    'sjf': ShortestJobFirstScheduler,
+    'fair': FairShareScheduler
+}
+
+def get_scheduler(name: Optional[str] = None) -> Scheduler:
+    """Create the scheduling policy named by SCHEDULER_POLICY"""
+    name = (name or os.getenv('SCHEDULER_POLICY') or 'fair').lower()
+    if name not in SCHEDULERS:
+        logger.warning(f"Unknown scheduler policy {name!r}, using fair share")
+        name = 'fair'
+    return SCHEDULERS[name]()
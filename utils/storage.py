@@ -0,0 +1,132 @@
+import os
+import re
+import shutil
+import tempfile
+import time
+from typing import Dict, Iterable, List, Tuple
+from utils.logger import logger
+from utils.metrics import metrics
+
+# Downloads of older versions: NamedTemporaryFile(suffix=f"_{name}") for URLs
+# in the system temp dir, and pyrogram's default downloads/ folder for Telegram
+LEGACY_PATTERN = re.compile(r'^tmp[a-z0-9_]{8}_')
+LEGACY_DOWNLOAD_DIR = 'downloads'
+# The temp dir is shared, leave anything recent to whoever is writing it
+LEGACY_MIN_AGE = 24 * 3600
+
+class StorageRejected(Exception):
+    """The item can never fit, retrying won't help"""
+
+class InsufficientStorage(Exception):
+    """Not enough free space right now, the item should wait"""
+
+class StorageManager:
+    """Scratch space for downloads, with space reserved before a transfer starts
+
+    Reservations are checked against the free space of WORK_DIR minus a
+    safety margin and an optional STORAGE_LIMIT, counting the part of each
+    reservation that hasn't been allocated on disk yet.
+    """
+
+    def __init__(self):
+        self.work_dir = os.getenv('WORK_DIR') or os.path.join(tempfile.gettempdir(), 'hydrax')
+        self.limit = int(os.getenv('STORAGE_LIMIT') or 0)
+        self.min_free = int(os.getenv('STORAGE_MIN_FREE') or 1024 * 1024 * 1024)
+        self.retry_delay = float(os.getenv('STORAGE_RETRY_DELAY') or 60)
+        self.reservations: Dict[str, Tuple[str, int]] = {}
+        os.makedirs(self.work_dir, exist_ok=True)
+        metrics.add_collector(self._collect_metrics)
+
+    def path(self, item_id: str, file_name: str) -> str:
+        """Get the scratch path of an item's download"""
+        return os.path.join(self.work_dir, f"hydrax_{item_id}_{os.path.basename(file_name)}")
+
+    def reserve(self, item_id: str, file_path: str, size: int):
+        """Reserve room for a download of size bytes, raising if it doesn't fit"""
+        usage = shutil.disk_usage(self.work_dir)
+        capacity = usage.total - self.min_free
+        if self.limit:
+            capacity = min(capacity, self.limit)
+        if size > capacity:
+            raise StorageRejected(f"File is larger than the available scratch space ({size} > {capacity} bytes)")
+
+        self.reservations.pop(item_id, None)
+
+        # A resumed download already holds part of its space on disk
+        needed = max(0, size - self._allocated(file_path))
+        if needed + self._outstanding() > usage.free - self.min_free:
+            raise InsufficientStorage("Not enough free disk space")
+        if self.limit and size + self.reserved() > self.limit:
+            raise InsufficientStorage("Scratch space limit reached")
+
+        self.reservations[item_id] = (file_path, size)
+
+    def release(self, item_id: str):
+        """Give back an item's reservation"""
+        self.reservations.pop(item_id, None)
+
+    def reserved(self) -> int:
+        """Get the total bytes currently reserved"""
+        return sum(size for _, size in self.reservations.values())
+
+    def _outstanding(self) -> int:
+        """Get the reserved bytes not yet allocated on disk"""
+        return sum(max(0, size - self._allocated(path)) for path, size in self.reservations.values())
+
+    @staticmethod
+    def _allocated(file_path: str) -> int:
+        try:
+            return os.stat(file_path).st_blocks * 512
+        except (FileNotFoundError, AttributeError):
+            return 0
+
+    def sweep(self, keep: Iterable[str]) -> int:
+        """Delete partial files that no saved transfer refers to, returning how many"""
+        keep = {os.path.abspath(path) for path in keep if path}
+        candidates = [
+            path for path in self._files(self.work_dir)
+            if os.path.basename(path).startswith('hydrax_') and path not in keep
+        ]
+
+        cutoff = time.time() - LEGACY_MIN_AGE
+        legacy = [
+            path for path in self._files(tempfile.gettempdir())
+            if LEGACY_PATTERN.match(os.path.basename(path))
+        ] + self._files(LEGACY_DOWNLOAD_DIR)
+        for path in legacy:
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    candidates.append(path)
+            except OSError:
+                continue
+
+        removed = 0
+        for path in set(candidates):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Could not remove orphaned file {path}: {e}")
+
+        if removed:
+            logger.info(f"Removed {removed} orphaned partial files")
+        return removed
+
+    @staticmethod
+    def _files(directory: str) -> List[str]:
+        """Get the absolute paths of the regular files in a directory"""
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        paths = (os.path.abspath(os.path.join(directory, name)) for name in names)
+        return [path for path in paths if os.path.isfile(path)]
+
+    def _collect_metrics(self):
+        metrics.set('hydrax_storage_reserved_bytes', self.reserved())
+        metrics.set('hydrax_storage_free_bytes', shutil.disk_usage(self.work_dir).free)
+
+storage = StorageManager()
+
+metrics.gauge('hydrax_storage_reserved_bytes', "Scratch space reserved by running downloads")
+metrics.gauge('hydrax_storage_free_bytes', "Free space on the work directory's volume")
@@ -0,0 +1,65 @@
+import os
+import socket
+import asyncio
+from pyrogram import Client, idle
+from dotenv import load_dotenv
+
+# Load environment variables before the modules that read them on import
+load_dotenv()
+
+from utils.logger import logger
+from utils.database import db
+from utils.metrics import metrics
+from utils.diagnostics import loop_monitor
+from utils.http_client import http_client
+from utils.storage import storage
+from utils.media import media_prober
+from handlers.upload import UploadHandler
+from userbot import start_userbot, stop_userbot
+
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+
+if not BOT_TOKEN:
+    logger.error("BOT_TOKEN must be set in environment variables")
+    exit(1)
+
+# Progress messages are sent through the bot, but updates stay with bot.py
+bot = Client(
+    f"hydrax_worker_{os.getpid()}",
+    bot_token=BOT_TOKEN,
+    api_id=2040,
+    api_hash="b18441a1ff607e10a989891a5462e627",
+    in_memory=True,
+    no_updates=True
+)
+
+# Each worker logs its userbot sessions in, give every worker.py its own SESSION_STRINGS
+upload_handler = UploadHandler(bot, worker_name=f"{socket.gethostname()}:{os.getpid()}")
+
+async def main():
+    """Work through the shared queue alongside the bot and other workers"""
+    loop_monitor.start()
+    await http_client.start()
+    await start_userbot()
+    await bot.start()
+    await metrics.start_server()
+
+    logger.info(f"Worker {upload_handler.worker_name} started")
+    if not db.active_items():
+        storage.sweep(db.transfer_paths())
+    upload_handler.wake_workers()
+    upload_handler.start_supervisor()
+
+    await idle()
+
+    # Hand unfinished items back instead of waiting for their leases to expire
+    await upload_handler.stop()
+    await metrics.stop_server()
+    await bot.stop()
+    await stop_userbot()
+    await http_client.close()
+    await loop_monitor.stop()
+    media_prober.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())